@@ -1,10 +1,19 @@
 import os
 import sys
+import json
+import hmac
+import hashlib
+import logging
+import time
+import shutil
+import zipfile
+import tempfile
 import pandas as pd
 from datetime import datetime
-from pandas.tseries.offsets import DateOffset
-from flask import Flask, request, send_file, jsonify
+from functools import partial
+from flask import Flask, Response, request, send_file, jsonify
 from io import BytesIO
+from xml.sax.saxutils import escape
 
 # Bibliotecas para PDF
 from reportlab.lib.pagesizes import A4
@@ -18,49 +27,169 @@ from reportlab.lib.units import cm
 # Habilitar CORS
 from flask_cors import CORS
 
+# Tabelas de índices (lidas uma vez, na importação de tabelas.py) e motor de cálculo
+from tabelas import ordinal_data, registro_tabelas, log_carga
+from motor import aplicar_normal, aplicar_punitiva, valores_iniciais
+from historico import Historico, rotulo_br, rotulo_iso
+from lote import (
+    FORMATOS_LOTE, normaliza_ativo, ler_ativos_json, ler_ativos_arquivo, linha_totais, linhas_totais,
+    csv_totais, zip_pdfs_em_fluxo
+)
+from paralelo import WORKERS_PADRAO, processar_ativos, encerrar_pool
+from fluxo_lote import FORMATOS_PLANILHA, EscritorCSV, EscritorXLSX, formato_arquivo, processar_planilha
+from cache import CacheLRU, CacheArquivos
+from checkpoints import totais_ativo
+from coortes import cache_coortes, plano_coorte
+from projecao import ler_cenarios, projetar, data_pagamento, ultimo_mes_tabelas, validar_alvos, mes_do_ordinal
+from jobs import MODOS_JOB, armazem_jobs, executor_jobs, progresso_job
+from metricas import (
+    metricas, Medidor, log, log_inicio, medir, somar_etapa, configurar_log, requisicoes, latencia_requisicao,
+    ativos_calculados, iniciar_requisicao, etapas_requisicao, encerrar_requisicao
+)
+
 app = Flask(__name__)
 CORS(app)  # Libera as requisições de outros domínios
 
+# Cache das séries calculadas (dashboards consultam os mesmos ativos repetidamente)
+cache_resultados = CacheLRU(int(os.environ.get("LMCALC_CACHE_RESULTADOS", 1024)))
+
+
 # #######################################
 # Caminhos das tabelas
 # #######################################
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 caminho_log = os.path.join(BASE_DIR, "log.txt")
 
-arquivo_tabela_pratica = os.path.join(BASE_DIR, "Tabela_Pratica_TJSP.xlsx")
-arquivo_tabela_ipcae   = os.path.join(BASE_DIR, "Tabela_IPCA-E.xlsx")
-arquivo_tabela_selic   = os.path.join(BASE_DIR, "Tabela_Selic.xlsx")
-arquivo_selic_antes    = os.path.join(BASE_DIR, "Selic_antes_2022.xlsx")
+# PDFs já gerados, por chave das entradas + versão das tabelas ("" desliga)
+cache_pdf = CacheArquivos(
+    os.environ.get("LMCALC_CACHE_PDF", os.path.join(BASE_DIR, ".cache_pdf")),
+    int(os.environ.get("LMCALC_CACHE_PDF_MAX_MB", 512)) * 1024 * 1024,
+    extensao=".pdf",
+)
 
 # #######################################
-# Ler as planilhas
+# Ciclo de vida do processo (servidor WSGI)
 # #######################################
-tabela_selic_antes = pd.read_excel(arquivo_selic_antes)
-tabela_selic_antes["PERÍODO DE VIGÊNCIA INICIAL"] = pd.to_datetime(tabela_selic_antes["PERÍODO DE VIGÊNCIA INICIAL"])
-tabela_selic_antes["PERÍODO DE VIGÊNCIA FINAL"]   = pd.to_datetime(tabela_selic_antes["PERÍODO DE VIGÊNCIA FINAL"])
-
-tabela_pratica = pd.read_excel(arquivo_tabela_pratica)
-tabela_ipcae   = pd.read_excel(arquivo_tabela_ipcae)
-tabela_selic   = pd.read_excel(arquivo_tabela_selic)
+# As tabelas são carregadas na importação (tabelas.py): com preload (gunicorn
+# --preload) isso acontece uma vez no processo mestre e os workers herdam os
+# arrays via fork, em copy-on-write. Threads não sobrevivem ao fork, então o
+# monitor das planilhas e o executor de jobs sobem por processo, em
+# iniciar_processo() (hook post_fork do gunicorn ou 1ª requisição do processo).
+_processo_iniciado = None
+
+def iniciar_processo():
+    """Sobe as threads deste processo: recarga das tabelas e jobs pendentes."""
+    global _processo_iniciado
+    _processo_iniciado = os.getpid()
+    # Recarrega as tabelas quando as planilhas mudam no disco (0 desliga)
+    registro_tabelas.iniciar_monitoramento(int(os.environ.get("LMCALC_RECARGA_TABELAS_S", 60)))
+    # Vários processos web (gunicorn.conf.py): /metrics soma os contadores de todos
+    if os.environ.get("LMCALC_METRICAS_DIR"):
+        metricas.compartilhar(os.environ["LMCALC_METRICAS_DIR"])
+    if armazem_jobs.tem_pendentes():
+        executor_jobs.iniciar()
+
+def encerrar_processo():
+    """Desligamento gracioso: devolve o job em andamento à fila e fecha os pools."""
+    executor_jobs.parar()
+    encerrar_pool(terminar=True)
+
+def criar_app():
+    """App WSGI para produção (wsgi.py); as tabelas já estão carregadas aqui."""
+    return app
 
-for tbl in [tabela_pratica, tabela_ipcae, tabela_selic]:
-    tbl["Ano"] = tbl["Ano"].astype(int)
-    tbl["Mês"] = tbl["Mês"].astype(int)
-
-tabela_selic.sort_values(by=["Ano", "Mês"], inplace=True, ignore_index=True)
+# #######################################
+# Log estruturado e métricas
+# #######################################
+# LMCALC_LOG=1 grava uma linha JSON por requisição (com o tempo de cada etapa)
+# em log.txt, com rotação; outro valor é o caminho do arquivo; vazio desliga.
+_destino_log = os.environ.get("LMCALC_LOG", "")
+configurar_log(
+    caminho_log if _destino_log == "1" else (_destino_log or None),
+    max_bytes=int(os.environ.get("LMCALC_LOG_MAX_BYTES", 10 * 1024 * 1024)),
+    arquivos=int(os.environ.get("LMCALC_LOG_ARQUIVOS", 5)),
+)
+# A carga inicial das tabelas (na importação) veio antes do log existir:
+# registra agora em log_inicio, que sai no stderr em INFO mesmo sem LMCALC_LOG
+log_carga(registro_tabelas.atual(), log_inicio)
+
+metricas.registrar(Medidor(
+    "lmcalc_cache_resultados_acertos_total", "Acertos do cache de séries",
+    lambda: cache_resultados.acertos, tipo="counter"))
+metricas.registrar(Medidor(
+    "lmcalc_cache_resultados_faltas_total", "Faltas do cache de séries",
+    lambda: cache_resultados.faltas, tipo="counter"))
+metricas.registrar(Medidor(
+    "lmcalc_cache_resultados_razao_acerto", "Taxa de acerto do cache de séries",
+    lambda: cache_resultados.taxa_acerto()))
+metricas.registrar(Medidor(
+    "lmcalc_cache_resultados_itens", "Entradas no cache de séries", lambda: len(cache_resultados)))
+metricas.registrar(Medidor(
+    "lmcalc_cache_pdf_acertos_total", "PDFs servidos do cache em disco",
+    lambda: cache_pdf.acertos, tipo="counter"))
+metricas.registrar(Medidor(
+    "lmcalc_cache_pdf_faltas_total", "PDFs gerados (não estavam no cache em disco)",
+    lambda: cache_pdf.faltas, tipo="counter"))
+metricas.registrar(Medidor(
+    "lmcalc_cache_coortes_razao_acerto", "Taxa de acerto do cache de coortes (Data Base, OC)",
+    lambda: cache_coortes.taxa_acerto()))
+metricas.registrar(Medidor(
+    "lmcalc_cache_coortes_itens", "Coortes no cache", lambda: len(cache_coortes)))
+metricas.registrar(Medidor(
+    "lmcalc_tabelas_carga_segundos", "Tempo da última carga das tabelas",
+    lambda: registro_tabelas.atual().tempo_carga))
+metricas.registrar(Medidor(
+    "lmcalc_tabelas_info", "Versão das tabelas em uso (valor sempre 1)",
+    lambda: {(registro_tabelas.atual().versao, "npy" if registro_tabelas.atual().do_cache else "xlsx"): 1},
+    rotulos=("versao", "origem")))
+
+@app.before_request
+def _inicio_requisicao():
+    request.lmcalc_inicio = time.perf_counter()
+    iniciar_requisicao()
+    if _processo_iniciado != os.getpid():
+        iniciar_processo()
+
+@app.after_request
+def _fim_requisicao(resposta):
+    # O corpo (arquivo, ZIP em fluxo...) só é transmitido depois da view: a etapa
+    # "envio", a latência e a linha do log são registradas quando o servidor
+    # fecha a resposta. Em fluxo, o envio inclui a geração dos pedaços.
+    inicio, fim_view = request.lmcalc_inicio, time.perf_counter()
+    rota = request.url_rule.rule if request.url_rule is not None else "desconhecida"
+    metodo, status, etapas = request.method, resposta.status_code, etapas_requisicao()
+
+    def _fim_envio():
+        agora = time.perf_counter()
+        somar_etapa("envio", agora - fim_view, etapas)
+        requisicoes.inc(rota, metodo, str(status))
+        latencia_requisicao.observar(agora - inicio, rota)
+        if log.isEnabledFor(logging.INFO):
+            log.info("requisicao", extra={"dados": {
+                "metodo": metodo,
+                "rota": rota,
+                "status": status,
+                "duracao_ms": round((agora - inicio) * 1000, 3),
+                "etapas_ms": {k: round(v * 1000, 3) for k, v in etapas.items()},
+            }})
+
+    resposta.call_on_close(_fim_envio)
+    return resposta
+
+@app.teardown_request
+def _limpa_requisicao(_erro=None):
+    encerrar_requisicao()
 
 # #######################################
 # Funções auxiliares
 # #######################################
+_TROCA_SEPARADORES = str.maketrans(",.", ".,")
+
 def br_format(value):
     """Converte float -> str em formato brasileiro (1.234,56)."""
     if pd.isna(value):
         return "-"
-    s = f"{value:,.2f}"
-    s = s.replace(",", "X")  # "123X456.78"
-    s = s.replace(".", ",")  # "123X456,78"
-    s = s.replace("X", ".")  # "123.456,78"
-    return s
+    return f"{value:,.2f}".translate(_TROCA_SEPARADORES)  # "123,456.78" -> "123.456,78"
 
 def regra_oc_data(ts: pd.Timestamp):
     """Calcula a OC via data do ofício/cessão (antigamente 'SEM OC')."""
@@ -88,37 +217,103 @@ def determina_oc(ativo_row):
 # #######################################
 # Gera PDF
 # #######################################
+# Estilos, cabeçalho e textos fixos são montados uma vez, na importação, e
+# reaproveitados em todos os PDFs (antes eram recriados a cada relatório).
+ESTILOS_PDF = getSampleStyleSheet()
+
+ESTILO_RESUMO = TableStyle([
+    ("SPAN", (0, 0), (1, 0)),
+    ("BACKGROUND", (0, 0), (1, 0), colors.black),
+    ("TEXTCOLOR", (0, 0), (1, 0), colors.whitesmoke),
+    ("ALIGN", (0, 0), (1, 0), "CENTER"),
+    ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+    ("BOX", (0, 0), (-1, -1), 0.8, colors.black),
+    ("INNERGRID", (0, 0), (-1, -1), 0.5, colors.grey)
+])
+
+ESTILO_HISTORICO = TableStyle([
+    ("ALIGN", (0, 0), (-1, 0), "CENTER"),
+    ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
+    ("GRID", (0, 0), (-1, -1), 0.5, colors.black),
+])
+
+CABECALHO_HISTORICO = ["Mês/Ano", "Principal", "Desc. Prev", "Desc. Assist", "Juros Normal", "Juros Punitivo", "Soma Juros"]
+COLUNAS_HISTORICO = [2.2 * cm] * 7
+
+# Históricos longos (300+ meses) viram várias tabelas menores: o ReportLab
+# quebra cada uma sem reprocessar o histórico inteiro a cada página, e o
+# cabeçalho se repete no topo de cada página e de cada bloco.
+LINHAS_POR_TABELA = int(os.environ.get("LMCALC_PDF_LINHAS_TABELA", 120))
+
+TEXTO_RODAPE = "LM Cálculos, com base na atualização DEPRE TJ-SP"
+
+# Relatórios: "completo" (mês a mês), "anual" (posição no último mês de cada
+# ano) e "resumo" (só cabeçalho e totais). Mudou o layout => sobe a versão, que
+# entra na chave do cache de PDFs.
+RELATORIOS_PDF = ("completo", "anual", "resumo")
+VERSAO_LAYOUT_PDF = 1
+
+def desenhar_rodape(data_hoje, canv, doc):
+    """Rodapé de cada página; data_hoje é calculada uma vez por PDF."""
+    canv.setFont("Helvetica", 8)
+    canv.drawString(2 * cm, 1.1 * cm, TEXTO_RODAPE)
+    canv.drawRightString(19.5 * cm, 1.1 * cm, f"Página {doc.page} - {data_hoje}")
+
+def linhas_historico(historico):
+    """Linhas (já formatadas) da tabela do histórico, em ordem cronológica, direto dos arrays."""
+    punitivo = historico.punitivo_ou_zeros()
+    soma_juros = historico.valores[:, 1] + punitivo
+    return [
+        [rotulo_br(o), br_format(p_), br_format(dp_), br_format(da_), br_format(j_), br_format(pun_), br_format(s_)]
+        for o, (p_, j_, dp_, da_), pun_, s_ in zip(
+            historico.ordinais.tolist(), historico.valores.tolist(), punitivo.tolist(), soma_juros.tolist()
+        )
+    ]
+
+def tabelas_historico(linhas):
+    """Divide o histórico em tabelas de até LINHAS_POR_TABELA linhas, com cabeçalho repetido."""
+    passo = max(1, LINHAS_POR_TABELA)
+    tabelas = []
+    for i in range(0, max(len(linhas), 1), passo):
+        tabela = Table([CABECALHO_HISTORICO] + linhas[i:i + passo], colWidths=COLUNAS_HISTORICO, repeatRows=1)
+        tabela.setStyle(ESTILO_HISTORICO)
+        tabelas.append(tabela)
+    return tabelas
+
 def gerar_pdf_para_ativo(
     nome_ativo,
     data_base_str,
     final_date,
-    historico_normal,
-    historico_punitivo,
+    historico,
     valor_total_final,
     ordem_cronologica,
-    valores_iniciais_str
+    valores_iniciais_str,
+    relatorio="completo"
 ):
-    """Cria PDF em memória, sem datas de cessão."""
-    styles = getSampleStyleSheet()
+    """
+    Cria PDF em memória, sem datas de cessão. `historico` é o Historico do
+    ativo e `relatorio` um de RELATORIOS_PDF.
+    """
     story = []
 
     # Título
-    titulo = Paragraph(f"<b>Relatório de Cálculo - {nome_ativo}</b>", styles["Title"])
+    # O nome vem do usuário: escapado para o parser de marcação do Paragraph
+    titulo = Paragraph(f"<b>Relatório de Cálculo - {escape(str(nome_ativo))}</b>", ESTILOS_PDF["Title"])
     story.append(titulo)
     story.append(Spacer(1, 0.3 * cm))
 
     # Cabeçalho
+    mes_ano_final = final_date.strftime("%m/%Y")
     head_html = f"""
     <b>VALORES INICIAIS</b><br/>{valores_iniciais_str}<br/><br/>
     <b>Ordem Cronológica:</b> {ordem_cronologica}<br/>
     <b>Data Base:</b> {data_base_str}<br/>
-    <b>Período calculado:</b> até {final_date.strftime('%m/%Y')}
+    <b>Período calculado:</b> até {mes_ano_final}
     """
-    story.append(Paragraph(head_html, styles["Normal"]))
+    story.append(Paragraph(head_html, ESTILOS_PDF["Normal"]))
     story.append(Spacer(1, 0.3 * cm))
 
     # Tabela Resumo (apenas Valor Total)
-    mes_ano_final = final_date.strftime("%m/%Y")
     titulo_resumo = f"RESUMO DO ATIVO ATÉ O MÊS {mes_ano_final}".upper()
 
     table_resumo_data = [
@@ -127,63 +322,20 @@ def gerar_pdf_para_ativo(
     ]
 
     table_resumo = Table(table_resumo_data, colWidths=[8 * cm, 9 * cm])
-    style_resumo = TableStyle([
-        ("SPAN", (0, 0), (1, 0)),
-        ("BACKGROUND", (0, 0), (1, 0), colors.black),
-        ("TEXTCOLOR", (0, 0), (1, 0), colors.whitesmoke),
-        ("ALIGN", (0, 0), (1, 0), "CENTER"),
-        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-        ("BOX", (0, 0), (-1, -1), 0.8, colors.black),
-        ("INNERGRID", (0, 0), (-1, -1), 0.5, colors.grey)
-    ])
-    table_resumo.setStyle(style_resumo)
+    table_resumo.setStyle(ESTILO_RESUMO)
     story.append(table_resumo)
     story.append(Spacer(1, 0.4 * cm))
 
-    # Tabela do histórico
-    pun_map = {x["data"]: x["acumulado"] for x in historico_punitivo}
-    header = ["Mês/Ano", "Principal", "Desc. Prev", "Desc. Assist", "Juros Normal", "Juros Punitivo", "Soma Juros"]
-    tdata = [header]
-
-    datas_hist = sorted(x["data"] for x in historico_normal)
-    for dt_ in datas_hist:
-        row_ = next(x for x in historico_normal if x["data"] == dt_)
-        p_ = row_["Principal Líquido"]
-        dp_ = row_["Desconto Previdenciário"]
-        da_ = row_["Desconto Assistência médica"]
-        jn_ = row_["Juros"]
-        pun_ = pun_map.get(dt_, 0.0)
-        soma_j = jn_ + pun_
-        mes_ano = dt_.strftime("%m/%Y")
-        tdata.append([
-            mes_ano,
-            br_format(p_),
-            br_format(dp_),
-            br_format(da_),
-            br_format(jn_),
-            br_format(pun_),
-            br_format(soma_j)
-        ])
-
-    st = TableStyle([
-        ("ALIGN", (0, 0), (-1, 0), "CENTER"),
-        ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
-        ("GRID", (0, 0), (-1, -1), 0.5, colors.black),
-    ])
-    colws = [2.2 * cm] * 7
-    hist_table = Table(tdata, colWidths=colws)
-    hist_table.setStyle(st)
-    story.append(hist_table)
-
-    # Rodapé
-    def rodape(canv, doc):
-        pag = doc.page
-        data_hoje = datetime.now().strftime("%d/%m/%Y %H:%M")
-        canv.setFont("Helvetica", 8)
-        left_txt = "LM Cálculos, com base na atualização DEPRE TJ-SP"
-        canv.drawString(2 * cm, 1.1 * cm, left_txt)
-        right_txt = f"Página {pag} - {data_hoje}"
-        canv.drawRightString(19.5 * cm, 1.1 * cm, right_txt)
+    # Tabela do histórico (mensal ou anual; o resumo não tem)
+    if relatorio != "resumo":
+        if relatorio == "anual":
+            story.append(Paragraph("<b>Posição no último mês de cada ano</b>", ESTILOS_PDF["Normal"]))
+            story.append(Spacer(1, 0.2 * cm))
+            historico = historico.anual()
+        story.extend(tabelas_historico(linhas_historico(historico)))
+
+    # Rodapé (mesma data/hora em todas as páginas)
+    rodape = partial(desenhar_rodape, datetime.now().strftime("%d/%m/%Y %H:%M"))
 
     pdf_buffer = BytesIO()
     doc = SimpleDocTemplate(pdf_buffer, pagesize=A4)
@@ -193,50 +345,62 @@ def gerar_pdf_para_ativo(
     return pdf_buffer
 
 # #######################################
-# Rota principal
+# Cálculo de um ativo
 # #######################################
-@app.route("/calcular", methods=["POST"])
-def calcular():
+def mes_atual():
+    """Primeiro dia do mês corrente (mês final padrão do cálculo)."""
+    today = pd.Timestamp.today()
+    return pd.Timestamp(year=today.year, month=today.month, day=1)
+
+def series_ativo(ordem_cronologica, ord_base, valores, ord_final, tabelas):
     """
-    Espera JSON de UM ativo com os campos:
-    {
-      "Nome Completo": "Fulano",
-      "Ordem Cronológica": "2020",
-      "Data Base": "2006-06-01",
-      "Principal Líquido": 10000.0,
-      "Juros": 500.0,
-      "Desconto Previdenciário": 200.0,
-      "Desconto Assistência médica": 150.0
-    }
+    Séries normal e punitiva de um ativo, com cache LRU.
 
-    Retorna um arquivo PDF com extensão .pdf.
+    A chave usa só o que muda o cálculo: OC, mês da Data Base, os 4 valores,
+    mês final e versão das tabelas. Os arrays devolvidos são somente leitura.
+    Na falta, aplica aos valores o plano da coorte (Data Base, OC): as mesmas
+    contas do cálculo mês a mês, na mesma ordem, e do caminho só-totais.
     """
-    data = request.get_json()
-    if not data or not isinstance(data, dict):
-        return jsonify({"error": "Formato JSON inválido. Esperamos um objeto com os campos do ativo"}), 400
+    chave = (ordem_cronologica, ord_base, tuple(valores.tolist()), ord_final, tabelas.versao)
+    series = cache_resultados.get(chave)
+    if series is None:
+        plano = plano_coorte(ordem_cronologica, ord_base, ord_final, tabelas)
+        ordinais = plano["ordinais"]
+        with medir("normal"):
+            serie, _ = aplicar_normal(valores, plano)
+        with medir("punitivo"):
+            acumulado_punitivo, _ = aplicar_punitiva(serie, plano["punitivo"])
+        for arr in (ordinais, serie, acumulado_punitivo):
+            if arr is not None:
+                arr.flags.writeable = False
+        series = (ordinais, serie, acumulado_punitivo)
+        cache_resultados.put(chave, series)
+    return series
+
+def entrada_ativo(data):
+    """
+    Valida e normaliza os campos de um ativo.
 
-    nome_ativo = data.get("Nome Completo", "NOME_NAO_INFORMADO")
-    print(f"\n================== Cálculo para {nome_ativo} ==================")
+    Retorna ((nome, OC, Data Base no dia 1, array dos 4 valores, texto dos
+    valores iniciais para o PDF), None) ou (None, mensagem de erro).
+    """
+    nome_ativo = data.get("Nome Completo") or "NOME_NAO_INFORMADO"
 
     oc, erro_oc = determina_oc(data)
     if oc is None:
-        msg = f"Ordem Cronológica inválida: {erro_oc}"
-        print(msg)
-        return jsonify({"error": msg}), 400
-    else:
-        ordem_cronologica = oc
+        return None, f"Ordem Cronológica inválida: {erro_oc}"
 
     data_base = pd.to_datetime(data.get("Data Base"), errors="coerce")
     if pd.isna(data_base):
-        msg = "Data Base ausente ou inválida"
-        print(msg)
-        return jsonify({"error": msg}), 400
+        return None, "Data Base ausente ou inválida"
 
-    val_princ = data.get("Principal Líquido", 0.0) or 0.0
-    val_juros = data.get("Juros", 0.0) or 0.0
-    val_dp    = data.get("Desconto Previdenciário", 0.0) or 0.0
-    val_da    = data.get("Desconto Assistência médica", 0.0) or 0.0
+    try:
+        valores = valores_iniciais(data)
+    except (TypeError, ValueError):
+        return None, "Valores do ativo devem ser numéricos"
 
+    # Texto do PDF a partir dos valores já validados (float)
+    val_princ, val_juros, val_dp, val_da = valores.tolist()
     valores_iniciais_str = (
        f"Principal Líquido: R$ {br_format(val_princ)}<br/>"
        f"Juros: R$ {br_format(val_juros)}<br/>"
@@ -244,262 +408,579 @@ def calcular():
        f"Desconto Assist: R$ {br_format(val_da)}"
     )
 
-    today = pd.Timestamp.today()
-    final_date = pd.Timestamp(year=today.year, month=today.month, day=1)
-    data_base_start = data_base.replace(day=1)
-    print(f"   Data Base: {data_base_start.strftime('%d/%m/%Y')}")
-    print(f"   OC: {ordem_cronologica}")
-
-    # Inicializa variáveis de cálculo
-    var_names = ["Principal Líquido", "Juros", "Desconto Previdenciário", "Desconto Assistência médica"]
-    normal_values = {}
-    normal_values[data_base_start] = {v: data.get(v, 0.0) for v in var_names}
-    historico_normal_soma = {}
-    historico_normal = []
-
-    current_date = data_base_start
-    selic_base_norm = {}
-    selic_acum_norm = {}
-
-    # 1) Atualização normal
-    if ordem_cronologica < 2022:
-        inicio_graça = pd.Timestamp(year=ordem_cronologica-1, month=7, day=1)
-        fim_graça    = pd.Timestamp(year=ordem_cronologica, month=12, day=31)
-    else:
-        inicio_graça = pd.Timestamp(year=ordem_cronologica-1, month=4, day=3)
-        fim_graça    = pd.Timestamp(year=ordem_cronologica, month=12, day=31)
+    return (nome_ativo, oc, data_base.replace(day=1), valores, valores_iniciais_str), None
 
-    while current_date <= final_date:
-        if current_date == data_base_start:
-            prev_date = current_date
-        else:
-            prev_date = current_date - DateOffset(months=1)
-            prev_date = prev_date.replace(day=1)
-
-        if current_date < pd.Timestamp(2022, 1, 1):
-            if inicio_graça <= current_date <= fim_graça:
-                if current_date == inicio_graça:
-                    new_vals = {}
-                    for v_ in var_names:
-                        new_vals[v_] = normal_values[prev_date][v_]
-                else:
-                    fp_arr = tabela_ipcae[
-                        (tabela_ipcae["Ano"] == prev_date.year) &
-                        (tabela_ipcae["Mês"] == prev_date.month)
-                    ]["Índice"].values
-                    fc_arr = tabela_ipcae[
-                        (tabela_ipcae["Ano"] == current_date.year) &
-                        (tabela_ipcae["Mês"] == current_date.month)
-                    ]["Índice"].values
-                    factor = 1.0
-                    if fp_arr.size and fc_arr.size:
-                        factor = fc_arr[0] / fp_arr[0]
-                    new_vals = {}
-                    for v_ in var_names:
-                        old_val = normal_values[prev_date][v_]
-                        new_vals[v_] = old_val * factor if pd.notna(old_val) else old_val
-            else:
-                fp_arr = tabela_pratica[
-                    (tabela_pratica["Ano"] == prev_date.year) &
-                    (tabela_pratica["Mês"] == prev_date.month)
-                ]["Índice"].values
-                fc_arr = tabela_pratica[
-                    (tabela_pratica["Ano"] == current_date.year) &
-                    (tabela_pratica["Mês"] == current_date.month)
-                ]["Índice"].values
-                if fp_arr.size and fc_arr.size:
-                    full_factor = fc_arr[0] / fp_arr[0]
-                else:
-                    full_factor = 1.0
-                new_vals = {}
-                for v_ in var_names:
-                    old_val = normal_values[prev_date][v_]
-                    if pd.isna(old_val):
-                        new_val = old_val
-                    else:
-                        if (current_date.year == 2021 and current_date.month == 12 and v_ == "Juros"):
-                            partial_factor = 1.0 + (full_factor - 1.0) * (8/31.0)
-                            new_val = old_val * partial_factor
-                        else:
-                            new_val = old_val * full_factor
-                    new_vals[v_] = new_val
-        else:
-            # >= 2022 => SELIC
-            new_vals = {}
-            for v_ in var_names:
-                if v_ not in selic_base_norm:
-                    if current_date == data_base_start:
-                        selic_base_norm[v_] = normal_values[current_date][v_]
-                    else:
-                        selic_base_norm[v_] = normal_values[prev_date][v_]
-                    selic_acum_norm[v_] = 0.0
-                selic_rate_arr = tabela_selic[
-                    (tabela_selic["Ano"] == current_date.year) &
-                    (tabela_selic["Mês"] == current_date.month)
-                ]["Índice"].values
-                rate = (selic_rate_arr[0] / 100) if selic_rate_arr.size else 0.0
-                juros_mes = selic_base_norm[v_] * rate
-                selic_acum_norm[v_] += juros_mes
-                new_val = selic_base_norm[v_] + selic_acum_norm[v_]
-                new_vals[v_] = new_val
-
-        normal_values[current_date] = new_vals
-        p_ = new_vals.get("Principal Líquido", 0.0) or 0.0
-        j_ = new_vals.get("Juros", 0.0) or 0.0
-        dp_ = new_vals.get("Desconto Previdenciário", 0.0) or 0.0
-        da_ = new_vals.get("Desconto Assistência médica", 0.0) or 0.0
-        total_ = p_ + j_ + dp_ + da_
-        historico_normal_soma[current_date] = total_
-
-        historico_normal.append({
-            "data": current_date,
-            "Principal Líquido": p_,
-            "Juros": j_,
-            "Desconto Previdenciário": dp_,
-            "Desconto Assistência médica": da_
-        })
-
-        if current_date.month == 12:
-            current_date = pd.Timestamp(year=current_date.year + 1, month=1, day=1)
-        else:
-            current_date = pd.Timestamp(year=current_date.year, month=current_date.month + 1, day=1)
+def calcular_ativo(data, final_date=None, tabelas=None, historico=True):
+    """
+    Calcula UM ativo (dict com os campos de /calcular) até final_date (padrão: mês atual).
 
-    # 2) Juros punitivos
-    punitivo_mes = {}
-    punitive_accum = 0.0
-    if data_base_start > pd.Timestamp(2021, 12, 1):
-        print("   Juros punitivos não se aplicam (Data Base > dez/2021).")
-    else:
-        pun_current_date = data_base_start
-        outside_grace_months = 0
-        last_punitivo = None
-        punitive_base_fixed = None
-        fixed_meta_end = pd.Timestamp(2012, 5, 1)
-
-        while pun_current_date <= final_date:
-            if pun_current_date == data_base_start:
-                pun_prev_date = pun_current_date
-            else:
-                pun_prev_date = pun_current_date - DateOffset(months=1)
-                pun_prev_date = pun_prev_date.replace(day=1)
-
-            if inicio_graça <= pun_current_date <= fim_graça:
-                outside_grace_months = 0
-                fp_arr = tabela_ipcae[
-                    (tabela_ipcae["Ano"] == pun_prev_date.year) &
-                    (tabela_ipcae["Mês"] == pun_prev_date.month)
-                ]["Índice"].values
-                fc_arr = tabela_ipcae[
-                    (tabela_ipcae["Ano"] == pun_current_date.year) &
-                    (tabela_ipcae["Mês"] == pun_current_date.month)
-                ]["Índice"].values
-                if pun_current_date == inicio_graça:
-                    update_factor = 1.0
-                else:
-                    if fp_arr.size and fc_arr.size:
-                        update_factor = fc_arr[0] / fp_arr[0]
-                    else:
-                        update_factor = 1.0
-                punitive_accum *= update_factor
-            else:
-                outside_grace_months += 1
-                if pun_current_date < pd.Timestamp(2022, 1, 1):
-                    vals = normal_values.get(pun_current_date, {})
-                    base_punitiva = 0.0
-                    if vals:
-                        base_punitiva += vals.get("Principal Líquido", 0.0) or 0.0
-                        base_punitiva += vals.get("Desconto Previdenciário", 0.0) or 0.0
-                        base_punitiva += vals.get("Desconto Assistência médica", 0.0) or 0.0
-
-                    if pun_current_date <= fixed_meta_end:
-                        if (pun_current_date.month == fixed_meta_end.month and pun_current_date.year == fixed_meta_end.year):
-                            total_rate = 0.005 * outside_grace_months
-                            outside_grace_months = 0
-                        else:
-                            total_rate = 0.0
-                    else:
-                        selic_rows = tabela_selic_antes[
-                            (tabela_selic_antes["PERÍODO DE VIGÊNCIA INICIAL"] <= pun_current_date) &
-                            (tabela_selic_antes["PERÍODO DE VIGÊNCIA FINAL"] >= pun_current_date)
-                        ]
-                        if not selic_rows.empty:
-                            meta_end = selic_rows.iloc[0]["PERÍODO DE VIGÊNCIA FINAL"]
-                            meta_anual = selic_rows.iloc[0]["META SELIC (A.A) %"]
-                            if (pun_current_date.month == meta_end.month and pun_current_date.year == meta_end.year):
-                                monthly_rate = 0.70 * ((meta_anual/12)/100) if meta_anual <= 8.5 else 0.005
-                                total_rate = monthly_rate * outside_grace_months
-                                outside_grace_months = 0
-                            else:
-                                total_rate = 0.0
-                        else:
-                            total_rate = 0.005
-
-                    new_increment = base_punitiva * total_rate
-                    fp_arr = tabela_pratica[
-                        (tabela_pratica["Ano"] == pun_prev_date.year) &
-                        (tabela_pratica["Mês"] == pun_prev_date.month)
-                    ]["Índice"].values
-                    fc_arr = tabela_pratica[
-                        (tabela_pratica["Ano"] == pun_current_date.year) &
-                        (tabela_pratica["Mês"] == pun_current_date.month)
-                    ]["Índice"].values
-                    if fp_arr.size and fc_arr.size:
-                        update_factor = fc_arr[0] / fp_arr[0]
-                    else:
-                        update_factor = 1.0
-                    punitive_accum = punitive_accum * update_factor + new_increment
-                else:
-                    if punitive_base_fixed is None:
-                        punitive_base_fixed = last_punitivo if last_punitivo else punitive_accum
-                    selic_rate_arr = tabela_selic[
-                        (tabela_selic["Ano"] == pun_current_date.year) &
-                        (tabela_selic["Mês"] == pun_current_date.month)
-                    ]["Índice"].values
-                    rate = selic_rate_arr[0] / 100 if selic_rate_arr.size else 0.0
-                    new_increment = punitive_base_fixed * rate
-                    punitive_accum += new_increment
-
-            last_punitivo = punitive_accum
-            punitivo_mes[pun_current_date] = punitive_accum
-
-            if pun_current_date.month == 12:
-                pun_current_date = pd.Timestamp(year=pun_current_date.year+1, month=1, day=1)
-            else:
-                pun_current_date = pd.Timestamp(year=pun_current_date.year, month=pun_current_date.month+1, day=1)
-
-    normal_soma_final = historico_normal_soma.get(final_date, 0.0)
-    punit_final = punitivo_mes.get(final_date, 0.0)
-    valor_total_ativo_final = normal_soma_final + punit_final
-
-    # Gera PDF
-    pdf_bytes = gerar_pdf_para_ativo(
-        nome_ativo=nome_ativo,
-        data_base_str=data_base_start.strftime("%d/%m/%Y"),
-        final_date=final_date,
-        historico_normal=historico_normal,
-        historico_punitivo=[{"data": d, "acumulado": val} for d, val in punitivo_mes.items()],
-        valor_total_final=valor_total_ativo_final,
-        ordem_cronologica=ordem_cronologica,
-        valores_iniciais_str=valores_iniciais_str
+    `tabelas` é o ConjuntoTabelas usado do início ao fim (padrão: o atual do registro).
+    Com historico=False devolve só os totais, avançando o checkpoint do ativo.
+    Retorna (resultado, None) ou (None, mensagem de erro), como determina_oc.
+    """
+    if tabelas is None:
+        tabelas = registro_tabelas.atual()
+    if final_date is None:
+        final_date = mes_atual()
+
+    with medir("validacao"):
+        entrada, erro = entrada_ativo(data)
+    if erro:
+        ativos_calculados.inc("erro")
+        log.info("Ativo rejeitado: %s", erro, extra={"dados": {"nome": data.get("Nome Completo"), "erro": erro}})
+        return None, erro
+    nome_ativo, ordem_cronologica, data_base_start, valores, valores_iniciais_str = entrada
+    ativos_calculados.inc("ok")
+    log.debug("Cálculo para %s (Data Base %s, OC %s)", nome_ativo, data_base_start.strftime("%d/%m/%Y"), ordem_cronologica)
+
+    resultado = {
+        "nome_ativo": nome_ativo,
+        "ordem_cronologica": ordem_cronologica,
+        "data_base": data_base_start,
+        "final_date": final_date,
+        "valores_iniciais_str": valores_iniciais_str,
+        "valores": tuple(valores.tolist()),
+        "versao_tabelas": tabelas.versao,
+    }
+
+    if not historico:
+        # Só totais: o checkpoint salvo avança apenas os meses novos; sem
+        # checkpoint, cálculo completo com o plano da coorte (Data Base, OC)
+        with medir("totais"):
+            normal_soma_final, punit_final = totais_ativo(
+                ordem_cronologica, ordinal_data(data_base_start), valores, ordinal_data(final_date), tabelas
+            )
+        resultado.update(
+            valor_normal_final=normal_soma_final,
+            valor_punitivo_final=punit_final,
+            valor_total_final=normal_soma_final + punit_final,
+        )
+        return resultado, None
+
+    # 1) Atualização normal e 2) juros punitivos (memorizados por entradas + versão das tabelas)
+    ordinais, serie, acumulado_punitivo = series_ativo(
+        ordem_cronologica, ordinal_data(data_base_start), valores, ordinal_data(final_date), tabelas
     )
+    historico_ativo = Historico(ordinais, serie, acumulado_punitivo)
+    normal_soma_final, punit_final = historico_ativo.finais()
+
+    resultado.update(
+        historico=historico_ativo,
+        valor_normal_final=normal_soma_final,
+        valor_punitivo_final=punit_final,
+        valor_total_final=normal_soma_final + punit_final,
+    )
+    return resultado, None
+
+def resultado_json(resultado):
+    """Resultado de calcular_ativo em formato JSON (totais + históricos mensais)."""
+    historico = resultado["historico"]
+    return {
+        "Nome Completo": resultado["nome_ativo"],
+        "Ordem Cronológica": resultado["ordem_cronologica"],
+        "Data Base": resultado["data_base"].strftime("%Y-%m-%d"),
+        "Mês Final": resultado["final_date"].strftime("%Y-%m-%d"),
+        "Valor Normal": resultado["valor_normal_final"],
+        "Juros Punitivos": resultado["valor_punitivo_final"],
+        "Valor Total do Ativo": resultado["valor_total_final"],
+        "versao_tabelas": resultado["versao_tabelas"],
+        "historico_normal": [
+            {
+                "data": rotulo_iso(o),
+                "Principal Líquido": p_,
+                "Juros": j_,
+                "Desconto Previdenciário": dp_,
+                "Desconto Assistência médica": da_,
+            }
+            for o, (p_, j_, dp_, da_) in zip(historico.ordinais.tolist(), historico.valores.tolist())
+        ],
+        # Juros punitivos não se aplicam com Data Base > dez/2021: lista vazia
+        "historico_punitivo": [
+            {"data": rotulo_iso(o), "acumulado": val}
+            for o, val in zip(historico.ordinais.tolist(), historico.punitivo.tolist())
+        ] if historico.punitivo is not None else [],
+    }
+
+def chave_pdf(nome_ativo, ordem_cronologica, data_base, valores, valores_iniciais_str, final_date,
+              versao_tabelas, relatorio):
+    """
+    Chave (sha256) do PDF: tudo o que aparece nele ou muda o cálculo, mais a
+    versão das tabelas e do layout. Serve de nome no cache em disco e de ETag.
+    """
+    bruto = json.dumps([
+        VERSAO_LAYOUT_PDF, relatorio, str(nome_ativo), ordem_cronologica, data_base.strftime("%Y-%m-%d"),
+        [float(v) for v in valores], valores_iniciais_str, final_date.strftime("%Y-%m-%d"), versao_tabelas,
+    ], ensure_ascii=False)
+    return hashlib.sha256(bruto.encode("utf-8")).hexdigest()
 
-    # Nome final => "LMCalc_[nome]_DDMMAAAA.pdf"
+def nome_pdf(nome_ativo):
+    """
+    Nome final => "LMCalc_[nome]_DDMMAAAA.pdf" (data de hoje). Sem separadores
+    de diretório nem "..": o nome vira entrada do ZIP do lote (zip-slip).
+    """
     hoje_str = datetime.now().strftime("%d%m%Y")
-    nome_sanitizado = nome_ativo.replace(" ", "_").replace("\"", "")
-    nome_final = f"LMCalc_{nome_sanitizado}_{hoje_str}.pdf"
+    nome_sanitizado = str(nome_ativo).replace(" ", "_").replace("\"", "")
+    nome_sanitizado = nome_sanitizado.replace("/", "_").replace("\\", "_").replace("..", "")
+    return f"LMCalc_{nome_sanitizado}_{hoje_str}.pdf"
+
+def pdf_do_resultado(resultado, relatorio="completo"):
+    """
+    PDF de um resultado de calcular_ativo, do cache em disco quando já gerado
+    com as mesmas entradas. Retorna (pdf_bytes, nome_final).
+    """
+    chave = chave_pdf(
+        resultado["nome_ativo"], resultado["ordem_cronologica"], resultado["data_base"], resultado["valores"],
+        resultado["valores_iniciais_str"], resultado["final_date"], resultado["versao_tabelas"], relatorio,
+    )
+    caminho = cache_pdf.obter(chave)
+    if caminho is not None:
+        try:
+            with open(caminho, "rb") as f:
+                return BytesIO(f.read()), nome_pdf(resultado["nome_ativo"])
+        except OSError:
+            pass  # removido pela poda de outro processo => gera de novo
+
+    with medir("pdf"):
+        pdf_bytes = gerar_pdf_para_ativo(
+            nome_ativo=resultado["nome_ativo"],
+            data_base_str=resultado["data_base"].strftime("%d/%m/%Y"),
+            final_date=resultado["final_date"],
+            historico=resultado["historico"],
+            valor_total_final=resultado["valor_total_final"],
+            ordem_cronologica=resultado["ordem_cronologica"],
+            valores_iniciais_str=resultado["valores_iniciais_str"],
+            relatorio=relatorio
+        )
+    cache_pdf.gravar(chave, pdf_bytes.getvalue())
+    return pdf_bytes, nome_pdf(resultado["nome_ativo"])
+
+# #######################################
+# Rota principal
+# #######################################
+@app.route("/calcular", methods=["POST"])
+def calcular():
+    """
+    Espera JSON de UM ativo com os campos:
+    {
+      "Nome Completo": "Fulano",
+      "Ordem Cronológica": "2020",
+      "Data Base": "2006-06-01",
+      "Principal Líquido": 10000.0,
+      "Juros": 500.0,
+      "Desconto Previdenciário": 200.0,
+      "Desconto Assistência médica": 150.0
+    }
 
-    return send_file(
+    Retorna um arquivo PDF com extensão .pdf, ou com ?format=json os totais e os
+    históricos mensais (normal e punitivo) em JSON, sem gerar o PDF.
+    ?relatorio=completo (padrão), anual ou resumo escolhe o conteúdo do PDF.
+
+    O PDF leva um ETag (chave das entradas + versão das tabelas): com
+    If-None-Match igual a resposta é 304, sem calcular nada, e PDFs já gerados
+    saem do cache em disco.
+    """
+    with medir("validacao"):
+        data = request.get_json()
+    if not data or not isinstance(data, dict):
+        return jsonify({"error": "Formato JSON inválido. Esperamos um objeto com os campos do ativo"}), 400
+
+    formato = (request.args.get("format") or "pdf").lower()
+    if formato not in ("pdf", "json"):
+        return jsonify({"error": f"format inválido: {formato}. Use pdf ou json"}), 400
+    relatorio = (request.args.get("relatorio") or "completo").lower()
+    if relatorio not in RELATORIOS_PDF:
+        return jsonify({"error": f"relatorio inválido: {relatorio}. Use completo, anual ou resumo"}), 400
+
+    final_date, tabelas = mes_atual(), registro_tabelas.atual()
+    if formato == "pdf":
+        # Mesmas entradas, mesmo mês e mesmas tabelas => mesmo PDF: nem calcula
+        with medir("validacao"):
+            entrada, erro = entrada_ativo(data)
+        if erro:
+            return jsonify({"error": erro}), 400
+        nome_ativo, ordem_cronologica, data_base_start, valores, valores_iniciais_str = entrada
+        chave = chave_pdf(
+            nome_ativo, ordem_cronologica, data_base_start, valores, valores_iniciais_str,
+            final_date, tabelas.versao, relatorio,
+        )
+        if chave in request.if_none_match:
+            resposta = Response(status=304)
+            resposta.set_etag(chave)
+            return resposta
+        caminho = cache_pdf.obter(chave)
+        if caminho is not None:
+            resposta = send_file(
+                caminho, as_attachment=True, download_name=nome_pdf(nome_ativo), mimetype="application/pdf"
+            )
+            resposta.set_etag(chave)
+            return resposta
+
+    resultado, erro = calcular_ativo(data, final_date, tabelas)
+    if erro:
+        return jsonify({"error": erro}), 400
+
+    if formato == "json":
+        return jsonify(resultado_json(resultado))
+
+    pdf_bytes, nome_final = pdf_do_resultado(resultado, relatorio)
+    resposta = send_file(
         pdf_bytes,
         as_attachment=True,
         download_name=nome_final,
         mimetype="application/pdf"
     )
+    resposta.set_etag(chave)
+    return resposta
+
+# #######################################
+# Cálculo em lote
+# #######################################
+PDFS_EM_ANDAMENTO = int(os.environ.get("LMCALC_PDFS_EM_ANDAMENTO", 2 * WORKERS_PADRAO))
+
+def resposta_zip(pedacos, download_name):
+    """Resposta com o ZIP gerado em pedaços (chunked): o download começa no 1º PDF."""
+    resposta = Response(pedacos, mimetype="application/zip", direct_passthrough=True)
+    resposta.headers["Content-Disposition"] = f'attachment; filename="{download_name}"'
+    return resposta
+
+@app.route("/calcular/lote", methods=["POST"])
+def calcular_lote():
+    """
+    Calcula vários ativos numa requisição só.
+
+    Entrada: JSON com uma lista de ativos (mesmos campos de /calcular) ou um
+    arquivo CSV/XLSX enviado no campo "arquivo" com essas colunas.
+    Saída (?format=): "zip" (padrão) com um LMCalc_*.pdf por ativo, enviado em
+    fluxo à medida que os PDFs ficam prontos, "json" ou "csv" com os totais.
+    Erros são informados por linha, sem abortar o lote.
+    Lotes grandes são distribuídos no pool de processos (LMCALC_WORKERS).
+    No zip, ?relatorio=completo (padrão), anual ou resumo, como em /calcular.
+    """
+    formato = (request.args.get("format") or request.form.get("format") or "zip").lower()
+    if formato not in FORMATOS_LOTE:
+        return jsonify({"error": f"format inválido: {formato}. Use zip, json ou csv"}), 400
+    relatorio = (request.args.get("relatorio") or request.form.get("relatorio") or "completo").lower()
+    if relatorio not in RELATORIOS_PDF:
+        return jsonify({"error": f"relatorio inválido: {relatorio}. Use completo, anual ou resumo"}), 400
+
+    ativos, erro = ler_ativos_requisicao()
+    if erro:
+        return jsonify({"error": erro}), 400
+
+    final_date = mes_atual()
+    tabelas = registro_tabelas.atual()
+    if formato != "zip":
+        resultados = list(processar_ativos(ativos, final_date, tabelas))
+
+    if formato == "json":
+        return jsonify(linhas_totais(ativos, resultados))
+    if formato == "csv":
+        return send_file(
+            csv_totais(linhas_totais(ativos, resultados)),
+            as_attachment=True,
+            download_name=f"LMCalc_lote_{datetime.now().strftime('%d%m%Y')}.csv",
+            mimetype="text/csv"
+        )
+
+    # ZIP em fluxo: cada PDF vai para a resposta assim que fica pronto, com no
+    # máximo PDFS_EM_ANDAMENTO em renderização ou esperando o cliente
+    pdfs = processar_ativos(
+        ativos, final_date, tabelas, modo="pdf", relatorio=relatorio, janela=PDFS_EM_ANDAMENTO
+    )
+    itens = ((i, ativo, pdf, erro) for i, (ativo, (pdf, erro)) in enumerate(zip(ativos, pdfs), start=1))
+    return resposta_zip(zip_pdfs_em_fluxo(itens), f"LMCalc_lote_{datetime.now().strftime('%d%m%Y')}.zip")
+
+# #######################################
+# Planilhas grandes em fluxo
+# #######################################
+@app.route("/calcular/planilha", methods=["POST"])
+def calcular_planilha():
+    """
+    Calcula um CSV/XLSX de ativos (campo "arquivo") lendo e escrevendo em blocos,
+    com memória constante mesmo em arquivos de centenas de milhares de linhas.
+
+    ?saida=csv|xlsx (padrão: o formato da entrada). ?historico=1 inclui o
+    histórico mensal: aba "Histórico" no XLSX (continua em "Histórico 2"...
+    acima do limite de linhas do Excel), ou ZIP com totais.csv e
+    historico.csv no CSV.
+    """
+    if "arquivo" not in request.files:
+        return jsonify({"error": "Envie a planilha no campo 'arquivo'"}), 400
+    arquivo = request.files["arquivo"]
+    try:
+        formato_entrada = formato_arquivo(arquivo.filename)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    saida = (request.args.get("saida") or request.form.get("saida") or formato_entrada).lower()
+    if saida not in FORMATOS_PLANILHA:
+        return jsonify({"error": f"saida inválida: {saida}. Use csv ou xlsx"}), 400
+    com_historico = (request.args.get("historico") or request.form.get("historico") or "").lower() in ("1", "true", "sim")
+
+    if saida == "xlsx":
+        destino = tempfile.TemporaryFile()
+        escritor = EscritorXLSX(destino, historico=com_historico)
+    elif com_historico:
+        totais_csv, historico_csv = tempfile.TemporaryFile(), tempfile.TemporaryFile()
+        escritor = EscritorCSV(totais_csv, historico_csv)
+    else:
+        destino = tempfile.TemporaryFile()
+        escritor = EscritorCSV(destino)
+    try:
+        processar_planilha(arquivo.stream, arquivo.filename, escritor, mes_atual(), registro_tabelas.atual())
+    except Exception as e:
+        return jsonify({"error": f"Não foi possível ler o arquivo: {e}"}), 400
+
+    hoje = datetime.now().strftime("%d%m%Y")
+    if saida == "csv" and com_historico:
+        # Os dois CSVs vão para o ZIP copiados em blocos, sem carregar na memória
+        destino = tempfile.TemporaryFile()
+        with zipfile.ZipFile(destino, "w", zipfile.ZIP_DEFLATED) as zf:
+            for nome, parte in (("totais.csv", totais_csv), ("historico.csv", historico_csv)):
+                parte.seek(0)
+                with zf.open(nome, "w") as z:
+                    shutil.copyfileobj(parte, z)
+                parte.close()
+        download_name, mimetype = f"LMCalc_planilha_{hoje}.zip", "application/zip"
+    elif saida == "csv":
+        download_name, mimetype = f"LMCalc_planilha_{hoje}.csv", "text/csv"
+    else:
+        download_name = f"LMCalc_planilha_{hoje}.xlsx"
+        mimetype = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    destino.seek(0)
+
+    return send_file(destino, as_attachment=True, download_name=download_name, mimetype=mimetype)
+
+# #######################################
+# Jobs em segundo plano
+# #######################################
+def ler_ativos_requisicao():
+    """Ativos do corpo JSON ou do arquivo CSV/XLSX ("arquivo"). Retorna (ativos, erro)."""
+    if "arquivo" in request.files:
+        return ler_ativos_arquivo(request.files["arquivo"])
+    return ler_ativos_json(request.get_json(silent=True))
+
+@app.route("/jobs", methods=["POST"])
+def job_criar():
+    """
+    Enfileira um lote para cálculo em segundo plano e responde na hora (202).
+
+    Entrada igual à de /calcular/lote. ?modo=totais (padrão) ou pdf. O
+    progresso fica em GET /jobs/<id> e os resultados já prontos em
+    GET /jobs/<id>/resultado, mesmo antes do fim do job.
+    """
+    modo = (request.args.get("modo") or request.form.get("modo") or "totais").lower()
+    if modo not in MODOS_JOB:
+        return jsonify({"error": f"modo inválido: {modo}. Use totais ou pdf"}), 400
+
+    ativos, erro = ler_ativos_requisicao()
+    if erro:
+        return jsonify({"error": erro}), 400
+
+    job_id = armazem_jobs.criar(ativos, modo, mes_atual())
+    executor_jobs.iniciar()
+    resposta = jsonify(progresso_job(armazem_jobs.obter(job_id)))
+    resposta.status_code = 202
+    resposta.headers["Location"] = f"/jobs/{job_id}"
+    return resposta
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_progresso(job_id):
+    """Status do job: feitos/falhas/total, ativos por segundo e ETA."""
+    job = armazem_jobs.obter(job_id)
+    if job is None:
+        return jsonify({"error": "Job não encontrado"}), 404
+    if job["status"] in ("fila", "executando"):
+        executor_jobs.iniciar()  # retoma jobs pendentes após um reinício
+    return jsonify(progresso_job(job))
+
+@app.route("/jobs/<job_id>/resultado", methods=["GET"])
+def job_resultado(job_id):
+    """
+    Resultados já calculados do job, na ordem de entrada.
+
+    Modo totais: ?format=json (padrão) ou csv. Modo pdf: ZIP com os PDFs e
+    erros.json. O cabeçalho X-Job-Status diz se o job já terminou.
+    """
+    job = armazem_jobs.obter(job_id)
+    if job is None:
+        return jsonify({"error": "Job não encontrado"}), 404
+
+    if job["modo"] == "pdf":
+        itens = (
+            (linha, ativo, (nome_pdf, pdf) if pdf is not None else None, erro)
+            for linha, ativo, _, nome_pdf, pdf, erro in armazem_jobs.resultados(job_id, com_pdf=True)
+        )
+        resposta = resposta_zip(
+            zip_pdfs_em_fluxo(itens), f"LMCalc_job_{job_id[:8]}_{datetime.now().strftime('%d%m%Y')}.zip"
+        )
+    else:
+        formato = (request.args.get("format") or "json").lower()
+        if formato not in ("json", "csv"):
+            return jsonify({"error": f"format inválido: {formato}. Use json ou csv"}), 400
+        linhas = [
+            totais if totais is not None else linha_totais(linha, ativo, None, erro)
+            for linha, ativo, totais, _, _, erro in armazem_jobs.resultados(job_id)
+        ]
+        if formato == "json":
+            resposta = jsonify(linhas)
+        else:
+            resposta = send_file(
+                csv_totais(linhas),
+                as_attachment=True,
+                download_name=f"LMCalc_job_{job_id[:8]}_{datetime.now().strftime('%d%m%Y')}.csv",
+                mimetype="text/csv"
+            )
+    resposta.headers["X-Job-Status"] = job["status"]
+    return resposta
+
+# #######################################
+# Projeções (datas futuras e cenários de SELIC / IPCA-E)
+# #######################################
+def projetar_ativo(data, datas, cenarios, tabelas):
+    """
+    Valores do ativo nas datas pedidas (padrão: dez/OC, fim do período de graça)
+    para cada cenário. Retorna (resultado JSON, None) ou (None, mensagem de erro).
+    """
+    with medir("validacao"):
+        entrada, erro = entrada_ativo(data if isinstance(data, dict) else {})
+    if erro:
+        return None, erro
+    nome_ativo, ordem_cronologica, data_base_start, valores, _ = entrada
+
+    ord_base = ordinal_data(data_base_start)
+    ords_alvo = [ordinal_data(d) for d in datas] if datas else [data_pagamento(ordem_cronologica)]
+    erro = validar_alvos(ords_alvo, tabelas, ord_base)
+    if erro:
+        return None, erro
+
+    with medir("projecao"):
+        normal, punitivo = projetar(ordem_cronologica, ord_base, valores, ords_alvo, cenarios, tabelas)
+    total = normal + punitivo
+    meses = [mes_do_ordinal(o).strftime("%Y-%m-%d") for o in ords_alvo]
+    return {
+        "Nome Completo": nome_ativo,
+        "Ordem Cronológica": ordem_cronologica,
+        "Data Base": data_base_start.strftime("%Y-%m-%d"),
+        "projecoes": [
+            {
+                "cenario": cenario["nome"],
+                "data": mes,
+                "Valor Normal": n_,
+                "Juros Punitivos": p_,
+                "Valor Total do Ativo": t_,
+            }
+            for cenario, linha_n, linha_p, linha_t in zip(cenarios, normal.tolist(), punitivo.tolist(), total.tolist())
+            for mes, n_, p_, t_ in zip(meses, linha_n, linha_p, linha_t)
+        ],
+    }, None
+
+@app.route("/projecao", methods=["POST"])
+def projecao():
+    """
+    Valor de um ou mais ativos em datas futuras, sob cenários de SELIC e IPCA-E.
+
+    {
+      "ativo": {...} ou "ativos": [{...}, ...],   (campos de /calcular)
+      "datas": ["2026-12-01", ...],               (opcional; padrão dez/OC)
+      "cenarios": [
+        {"nome": "base", "selic": 0.9, "ipcae": {"padrao": 0.4, "2026-01": 0.6}},
+        ...
+      ]
+    }
+
+    Taxas em % ao mês. Até o último mês das tabelas valem as tabelas; depois,
+    o valor do mês no cenário, senão o "padrao" dele (sem curva: SELIC 0 e
+    IPCA-E sem variação, como /calcular). Todos os cenários são avançados
+    juntos a partir do estado do ativo no fim das tabelas.
+    """
+    with medir("validacao"):
+        corpo = request.get_json(silent=True)
+        if not isinstance(corpo, dict):
+            return jsonify({"error": "Formato JSON inválido. Esperamos um objeto com ativo(s), datas e cenarios"}), 400
+
+        ativos = corpo.get("ativos", [corpo["ativo"]] if "ativo" in corpo else None)
+        if not isinstance(ativos, list) or not ativos:
+            return jsonify({"error": "Informe \"ativo\" (objeto) ou \"ativos\" (lista)"}), 400
+
+        datas = corpo.get("datas")
+        if datas is not None:
+            datas = [pd.to_datetime(d, errors="coerce") for d in (datas if isinstance(datas, list) else [datas])]
+            if not datas or any(pd.isna(d) for d in datas):
+                return jsonify({"error": "datas deve ser uma lista de datas (AAAA-MM-DD)"}), 400
+
+        cenarios, erro = ler_cenarios(corpo.get("cenarios"))
+        if erro:
+            return jsonify({"error": erro}), 400
+
+    tabelas = registro_tabelas.atual()
+    saida = []
+    for linha, ativo in enumerate(ativos, start=1):
+        # Mesma normalização de /calcular/lote (OC numérica => texto etc.) e erro por ativo
+        if isinstance(ativo, dict):
+            ativo = normaliza_ativo(ativo)
+        try:
+            resultado, erro = projetar_ativo(ativo, datas, cenarios, tabelas)
+        except Exception as e:
+            resultado, erro = None, f"Erro no cálculo: {e}"
+        if erro:
+            nome = ativo.get("Nome Completo") if isinstance(ativo, dict) else None
+            resultado = {"linha": linha, "Nome Completo": nome, "erro": erro}
+        saida.append(resultado)
+
+    return jsonify({
+        "versao_tabelas": tabelas.versao,
+        "ultimo_mes_tabelas": mes_do_ordinal(ultimo_mes_tabelas(tabelas)).strftime("%Y-%m-%d"),
+        "cenarios": [c["nome"] for c in cenarios],
+        "ativos": saida,
+    })
+
+# #######################################
+# Tabelas: versão e atualização
+# #######################################
+@app.route("/tabelas", methods=["GET"])
+def tabelas_versao():
+    """Versão das tabelas em uso (a mesma que vai nos resultados e nas chaves de cache)."""
+    tabelas = registro_tabelas.atual()
+    return jsonify({
+        "versao_tabelas": tabelas.versao,
+        "carregado_em": datetime.fromtimestamp(tabelas.carregado_em).strftime("%Y-%m-%d %H:%M:%S"),
+        "tempo_carga_ms": round(tabelas.tempo_carga * 1000, 1),
+        "arquivos": {nome: os.path.basename(c) for nome, c in registro_tabelas.arquivos.items()},
+    })
+
+@app.route("/admin/tabelas/<nome>", methods=["POST"])
+def tabelas_atualizar(nome):
+    """
+    Publica uma nova planilha (campo "arquivo") sem reiniciar o serviço.
+
+    nome: pratica, ipcae, selic ou selic_antes. Exige o cabeçalho
+    X-Admin-Token igual a LMCALC_ADMIN_TOKEN (sem a variável, a rota fica desligada).
+    """
+    token = os.environ.get("LMCALC_ADMIN_TOKEN")
+    recebido = request.headers.get("X-Admin-Token") or ""
+    if not token or not hmac.compare_digest(recebido.encode("utf-8"), token.encode("utf-8")):
+        return jsonify({"error": "Não autorizado"}), 403
+    if "arquivo" not in request.files:
+        return jsonify({"error": "Envie a planilha no campo 'arquivo'"}), 400
+    try:
+        tabelas = registro_tabelas.instalar_planilha(nome, request.files["arquivo"].read())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"versao_tabelas": tabelas.versao})
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Métricas no formato texto do Prometheus. Com LMCALC_METRICAS_DIR (gunicorn),
+    contadores e histogramas somam todos os processos web; gauges são deste processo.
+    """
+    return Response(metricas.texto(), mimetype="text/plain; version=0.0.4; charset=utf-8")
 
 @app.route("/")
 def home():
     return "API de Cálculo e PDF (sem data de cessão) - Online!"
 
 if __name__ == '__main__':
-    import os
+    # Servidor de desenvolvimento; em produção use wsgi.py (gunicorn/waitress)
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    app.run(host='0.0.0.0', port=port, debug=os.environ.get("LMCALC_DEBUG") == "1")
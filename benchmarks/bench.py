@@ -0,0 +1,188 @@
+"""
+Benchmarks do cálculo, do PDF e do lote, com as tabelas reais (Tabela_*.xlsx).
+
+Uso:
+    python benchmarks/bench.py                       # só mostra
+    python benchmarks/bench.py --salvar base.json    # grava o resultado
+    python benchmarks/bench.py --comparar benchmarks/baseline.json
+
+O cache de resultados, o de coortes, o de PDFs em disco e os checkpoints ficam desligados: cada
+chamada refaz o cálculo inteiro, que é o que se quer medir. A referência de
+desempenho versionada é benchmarks/baseline.json (regravar com --salvar ao mudar o motor,
+anotando a máquina).
+"""
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import contextlib
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["LMCALC_CHECKPOINTS"] = ""
+os.environ["LMCALC_CACHE_RESULTADOS"] = "0"
+os.environ["LMCALC_CACHE_COORTES"] = "0"
+os.environ["LMCALC_CACHE_PDF"] = ""
+os.environ.setdefault("LMCALC_RECARGA_TABELAS_S", "0")
+
+import pandas as pd
+
+from app import calcular_ativo, pdf_do_resultado
+from tabelas import RegistroTabelas, registro_tabelas
+from paralelo import processar_ativos, WORKERS_PADRAO
+
+MES_FINAL = pd.Timestamp("2025-02-01")  # último mês coberto por todas as tabelas
+
+FAIXAS_DATA_BASE = {
+    "anos 1990": "1995-06-01",
+    "anos 2000": "2005-06-01",
+    "anos 2010": "2015-06-01",
+    "pós-2022": "2023-06-01",
+}
+REGIMES_OC = {
+    "OC<2022": "0001/2021",   # graça jul/(OC-1)..dez/OC
+    "OC≥2022": "0001/2025",   # graça a partir de mai/(OC-1)
+}
+
+def ativo(nome, data_base, oc, rnd=None):
+    rnd = rnd or random.Random(0)
+    return {
+        "Nome Completo": nome,
+        "Ordem Cronológica": oc,
+        "Data Base": data_base,
+        "Principal Líquido": round(rnd.uniform(1e3, 1e6), 2),
+        "Juros": round(rnd.uniform(0, 1e5), 2),
+        "Desconto Previdenciário": round(rnd.uniform(0, 1e4), 2),
+        "Desconto Assistência médica": round(rnd.uniform(0, 1e4), 2),
+    }
+
+def cronometrar(funcao, repeticoes):
+    """Tempos (ms) de `repeticoes` chamadas, após uma de aquecimento."""
+    funcao()
+    tempos = []
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        funcao()
+        tempos.append((time.perf_counter() - t0) * 1000)
+    return tempos
+
+def resumo(tempos):
+    tempos = sorted(tempos)
+    return {
+        "mediana_ms": round(statistics.median(tempos), 3),
+        "p95_ms": round(tempos[int(0.95 * (len(tempos) - 1))], 3),
+    }
+
+def bench_calculo(repeticoes):
+    """Latência por ativo, por faixa de Data Base e regime de OC (histórico completo e só totais)."""
+    saida = {}
+    for faixa, data_base in FAIXAS_DATA_BASE.items():
+        for regime, oc in REGIMES_OC.items():
+            if int(oc[-4:]) < int(data_base[:4]):
+                continue  # OC anterior à Data Base não ocorre na prática
+            a = ativo(f"{faixa} {regime}", data_base, oc)
+            completo = cronometrar(lambda: calcular_ativo(a, MES_FINAL), repeticoes)
+            totais = cronometrar(lambda: calcular_ativo(a, MES_FINAL, historico=False), repeticoes)
+            saida[f"{faixa} / {regime}"] = {"historico": resumo(completo), "totais": resumo(totais)}
+    return saida
+
+def bench_pdf(repeticoes):
+    """Tempo de montagem do PDF por tamanho de histórico."""
+    saida = {}
+    for data_base in ("1976-10-01", "2000-01-01", "2020-01-01"):
+        resultado, _ = calcular_ativo(ativo("PDF", data_base, "0001/2021"), MES_FINAL)
+        meses = len(resultado["historico"])
+        saida[f"{meses} meses"] = resumo(cronometrar(lambda: pdf_do_resultado(resultado), repeticoes))
+    return saida
+
+def bench_lote(n_totais, n_pdf, workers):
+    """Vazão (ativos/s) do lote: só totais e com PDF."""
+    rnd = random.Random(1)
+    ativos = [
+        ativo(f"Lote {i}", f"{rnd.randint(1980, 2023)}-{rnd.randint(1, 12):02d}-01", f"{rnd.randint(2010, 2027)}", rnd)
+        for i in range(max(n_totais, n_pdf))
+    ]
+    tabelas = registro_tabelas.atual()
+    saida = {"workers": workers}
+    # Sobe o pool (forkserver importa o app) fora da medição: mede o lote, não a subida
+    for _ in processar_ativos(ativos[:workers], MES_FINAL, tabelas, workers=workers, local=workers <= 1):
+        pass
+    for modo, n in (("totais", n_totais), ("pdf", n_pdf)):
+        t0 = time.perf_counter()
+        for _ in processar_ativos(ativos[:n], MES_FINAL, tabelas, modo=modo, workers=workers):
+            pass
+        decorrido = time.perf_counter() - t0
+        saida[modo] = {"ativos": n, "segundos": round(decorrido, 3), "ativos_por_segundo": round(n / decorrido, 1)}
+    return saida
+
+def bench_tabelas(repeticoes):
+    """Carga das tabelas (cache .npy) num registro novo, como na subida de um worker."""
+    return resumo(cronometrar(lambda: RegistroTabelas(registro_tabelas.arquivos).recarregar(), repeticoes))
+
+def mostrar(resultado, referencia=None):
+    def comparar(caminho, valor):
+        if referencia is None:
+            return ""
+        ref = referencia
+        for chave in caminho:
+            ref = ref.get(chave) if isinstance(ref, dict) else None
+        if not ref:
+            return ""
+        return f"  ({valor / ref:.2f}x da referência)"
+
+    print(f"\n== Cálculo por ativo (ms, mês final {MES_FINAL:%m/%Y}) ==")
+    for cenario, r in resultado["calculo"].items():
+        h, t = r["historico"]["mediana_ms"], r["totais"]["mediana_ms"]
+        print(f"  {cenario:<24} histórico {h:8.3f}{comparar(('calculo', cenario, 'historico', 'mediana_ms'), h)}"
+              f" | totais {t:8.3f}{comparar(('calculo', cenario, 'totais', 'mediana_ms'), t)}")
+    print("\n== PDF (ms) ==")
+    for cenario, r in resultado["pdf"].items():
+        print(f"  {cenario:<24} {r['mediana_ms']:8.1f}{comparar(('pdf', cenario, 'mediana_ms'), r['mediana_ms'])}")
+    lote = resultado["lote"]
+    print(f"\n== Lote ({lote['workers']} workers) ==")
+    for modo in ("totais", "pdf"):
+        v = lote[modo]["ativos_por_segundo"]
+        print(f"  {modo:<24} {v:8.1f} ativos/s{comparar(('lote', modo, 'ativos_por_segundo'), v)}")
+    print(f"\n== Tabelas ==\n  carga (.npy)             {resultado['tabelas']['mediana_ms']:8.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticoes", type=int, default=30)
+    parser.add_argument("--lote", type=int, default=2000, help="ativos no lote só-totais")
+    parser.add_argument("--lote-pdf", type=int, default=100, help="ativos no lote com PDF")
+    parser.add_argument("--workers", type=int, default=WORKERS_PADRAO)
+    parser.add_argument("--salvar", help="grava o resultado em JSON")
+    parser.add_argument("--comparar", help="JSON de referência (ex.: benchmarks/baseline.json)")
+    args = parser.parse_args()
+
+    # O cálculo imprime o progresso de cada ativo; não entra na medição
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        resultado = {
+            "maquina": {
+                "python": platform.python_version(),
+                "processador": platform.processor() or platform.machine(),
+                "cpus": os.cpu_count(),
+            },
+            "versao_tabelas": registro_tabelas.atual().versao,
+            "calculo": bench_calculo(args.repeticoes),
+            "pdf": bench_pdf(max(3, args.repeticoes // 6)),
+            "lote": bench_lote(args.lote, args.lote_pdf, args.workers),
+            "tabelas": bench_tabelas(args.repeticoes),
+        }
+
+    referencia = None
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            referencia = json.load(f)
+    mostrar(resultado, referencia)
+
+    if args.salvar:
+        with open(args.salvar, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+        print(f"\nResultado gravado em {args.salvar}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import os
+import threading
+from collections import OrderedDict
+
+# #######################################
+# Cache LRU com limite de tamanho
+# #######################################
+class CacheLRU:
+    """
+    Cache LRU thread-safe com número máximo de entradas.
+
+    Guarda contadores de acertos/faltas para acompanhar a taxa de acerto.
+    maxsize <= 0 desliga o cache.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.faltas = 0
+
+    def get(self, chave, padrao=None):
+        with self._lock:
+            if chave in self._dados:
+                self._dados.move_to_end(chave)
+                self.acertos += 1
+                return self._dados[chave]
+            self.faltas += 1
+            return padrao
+
+    def put(self, chave, valor):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._dados[chave] = valor
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.maxsize:
+                self._dados.popitem(last=False)
+
+    def taxa_acerto(self):
+        """Acertos / consultas (0.0 sem consultas)."""
+        consultas = self.acertos + self.faltas
+        return self.acertos / consultas if consultas else 0.0
+
+    def limpar(self):
+        with self._lock:
+            self._dados.clear()
+
+    def __len__(self):
+        return len(self._dados)
+
+    def __contains__(self, chave):
+        return chave in self._dados
+
+# #######################################
+# Cache em disco endereçado por conteúdo
+# #######################################
+class CacheArquivos:
+    """
+    Arquivos (PDFs) em disco por chave hexadecimal, em subpastas pelos 2
+    primeiros caracteres. A gravação é atômica (tmp + os.replace), então vários
+    processos podem dividir a pasta. Acima de max_bytes os arquivos menos
+    usados (mtime, renovado a cada acerto) são removidos.
+    Diretório vazio/None desliga o cache.
+    """
+
+    def __init__(self, diretorio, max_bytes, extensao=""):
+        self.diretorio = diretorio
+        self.max_bytes = max_bytes
+        self.extensao = extensao
+        self._lock = threading.Lock()
+        self._gravados = 0  # bytes gravados desde a última poda
+        self.acertos = 0
+        self.faltas = 0
+
+    def caminho(self, chave):
+        return os.path.join(self.diretorio, chave[:2], chave + self.extensao)
+
+    def obter(self, chave):
+        """Caminho do arquivo da chave, ou None."""
+        if not self.diretorio:
+            return None
+        caminho = self.caminho(chave)
+        try:
+            os.utime(caminho)
+        except OSError:
+            self.faltas += 1
+            return None
+        self.acertos += 1
+        return caminho
+
+    def gravar(self, chave, conteudo):
+        """Grava o conteúdo (bytes) da chave; falha de escrita só deixa de cachear."""
+        if not self.diretorio:
+            return None
+        caminho = self.caminho(chave)
+        try:
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+            tmp = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(conteudo)
+            os.replace(tmp, caminho)
+        except OSError:
+            return None
+        with self._lock:
+            self._gravados += len(conteudo)
+            podar = self._gravados > self.max_bytes // 10
+            if podar:
+                self._gravados = 0
+        if podar:
+            self.podar()
+        return caminho
+
+    def podar(self):
+        """Remove os arquivos menos usados até ficar abaixo de 90% de max_bytes."""
+        arquivos = []
+        for raiz, _, nomes in os.walk(self.diretorio):
+            for nome in nomes:
+                caminho = os.path.join(raiz, nome)
+                try:
+                    st = os.stat(caminho)
+                except OSError:
+                    continue
+                arquivos.append((st.st_mtime, st.st_size, caminho))
+        total = sum(tamanho for _, tamanho, _ in arquivos)
+        for _, tamanho, caminho in sorted(arquivos):
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(caminho)
+            except OSError:
+                continue
+            total -= tamanho
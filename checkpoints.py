@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from motor import estado_final, pode_avancar, avancar_estado, totais_estado
+from tabelas import BASE_DIR
+from coortes import plano_coorte
+from metricas import metricas, Contador
+
+# #######################################
+# Checkpoints do cálculo (SQLite)
+# #######################################
+# Guarda, por ativo, o estado no último mês calculado: os 4 valores, base e
+# acumulado SELIC e o acumulado (e base congelada) dos juros punitivos. Na virada
+# do mês o ativo avança só os meses novos; se a versão das tabelas mudou, ou o
+# estado ainda é anterior a 2022, refaz o cálculo completo, com o plano da
+# coorte (coortes.py). Os dois caminhos fazem as contas do histórico completo,
+# na mesma ordem: os totais batem com calcular_ativo centavo a centavo.
+CAMINHO_CHECKPOINTS = os.environ.get("LMCALC_CHECKPOINTS", os.path.join(BASE_DIR, "checkpoints.sqlite"))
+
+def chave_ativo(ordem_cronologica, ord_base, valores):
+    """Identifica o ativo pelas entradas que definem o cálculo (sem o nome)."""
+    bruto = json.dumps([ordem_cronologica, ord_base, [float(v) for v in valores]])
+    return hashlib.sha1(bruto.encode()).hexdigest()
+
+class ArmazemCheckpoints:
+    """Armazém SQLite de estados por ativo; uma conexão por thread/processo."""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._local = threading.local()
+
+    def _conexao(self):
+        con = getattr(self._local, "con", None)
+        if con is None or getattr(self._local, "pid", None) != os.getpid():
+            con = sqlite3.connect(self.caminho, timeout=30)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute(
+                """CREATE TABLE IF NOT EXISTS checkpoints (
+                    chave TEXT PRIMARY KEY,
+                    versao_tabelas TEXT NOT NULL,
+                    ord_mes INTEGER NOT NULL,
+                    estado TEXT NOT NULL,
+                    atualizado_em REAL NOT NULL
+                )"""
+            )
+            self._local.con, self._local.pid = con, os.getpid()
+        return con
+
+    def obter(self, chave):
+        """Retorna (versao_tabelas, estado) ou None."""
+        row = self._conexao().execute(
+            "SELECT versao_tabelas, estado FROM checkpoints WHERE chave = ?", (chave,)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def salvar(self, chave, versao, estado):
+        con = self._conexao()
+        with con:
+            con.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?)",
+                (chave, versao, estado["ord_mes"], json.dumps(estado), time.time()),
+            )
+
+usos_checkpoint = metricas.registrar(Contador(
+    "lmcalc_checkpoints_total", "Totais via checkpoint: incremental (reaproveitado) ou completo", ("tipo",)))
+
+armazem_checkpoints = ArmazemCheckpoints(CAMINHO_CHECKPOINTS) if CAMINHO_CHECKPOINTS else None
+
+def _estado_completo(ordem_cronologica, ord_base, valores, ord_final, tabelas):
+    plano = plano_coorte(ordem_cronologica, ord_base, ord_final, tabelas)
+    return estado_final(valores, ord_base, ord_final, ordem_cronologica, tabelas, plano)
+
+def estado_ativo(ordem_cronologica, ord_base, valores, ord_final, tabelas, armazem=None):
+    """
+    Estado do ativo em ord_final, avançando o checkpoint salvo quando possível.
+    Retorna (estado, incremental) com incremental=True se veio do checkpoint.
+    """
+    armazem = armazem_checkpoints if armazem is None else armazem
+    if not armazem:
+        return _estado_completo(ordem_cronologica, ord_base, valores, ord_final, tabelas), False
+
+    chave = chave_ativo(ordem_cronologica, ord_base, valores)
+    salvo = armazem.obter(chave)
+    if salvo is not None:
+        versao, estado = salvo
+        if versao == tabelas.versao and pode_avancar(estado, ord_final):
+            usos_checkpoint.inc("incremental")
+            if estado["ord_mes"] == ord_final:
+                return estado, True
+            estado = avancar_estado(estado, ord_final, ordem_cronologica, tabelas)
+            armazem.salvar(chave, tabelas.versao, estado)
+            return estado, True
+
+    usos_checkpoint.inc("completo")
+    estado = _estado_completo(ordem_cronologica, ord_base, valores, ord_final, tabelas)
+    # Não volta o checkpoint para um mês anterior ao já salvo (mesma versão)
+    if estado is not None and not (
+        salvo is not None and salvo[0] == tabelas.versao and salvo[1]["ord_mes"] > ord_final
+    ):
+        armazem.salvar(chave, tabelas.versao, estado)
+    return estado, False
+
+def totais_ativo(ordem_cronologica, ord_base, valores, ord_final, tabelas, armazem=None):
+    """(valor normal, juros punitivos) no mês final, via checkpoint."""
+    estado, _ = estado_ativo(ordem_cronologica, ord_base, valores, ord_final, tabelas, armazem)
+    return totais_estado(estado)
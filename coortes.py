@@ -0,0 +1,30 @@
+import os
+
+from cache import CacheLRU
+from motor import plano_calculo
+
+# #######################################
+# Plano do cálculo por coorte (mês da Data Base, OC)
+# #######################################
+# Ativos com o mesmo mês de Data Base e a mesma OC leem das tabelas os mesmos
+# fatores, taxas SELIC e multiplicadores dos juros punitivos, mês a mês; só os
+# 4 valores iniciais mudam. O plano (motor.plano_calculo) é montado uma vez por
+# coorte e reaproveitado: cada ativo só aplica as contas aos seus valores, na
+# mesma ordem do cálculo completo, então os totais batem com o histórico
+# centavo a centavo. Arrays somente leitura.
+cache_coortes = CacheLRU(int(os.environ.get("LMCALC_CACHE_COORTES", 512)))
+
+def plano_coorte(ordem_cronologica, ord_base, ord_final, tabelas):
+    """plano_calculo da coorte, do cache quando já montado (chave inclui a versão das tabelas)."""
+    chave = (ordem_cronologica, ord_base, ord_final, tabelas.versao)
+    plano = cache_coortes.get(chave)
+    if plano is None:
+        plano = plano_calculo(ord_base, ord_final, ordem_cronologica, tabelas)
+        arrays = [plano["ordinais"], plano["fatores"], plano["taxas_selic"]]
+        if plano["punitivo"] is not None:
+            arrays.extend(v for v in plano["punitivo"].values() if hasattr(v, "flags"))
+        for arr in arrays:
+            if arr is not None:
+                arr.flags.writeable = False
+        cache_coortes.put(chave, plano)
+    return plano
@@ -0,0 +1,212 @@
+import os
+import io
+import csv
+import sys
+import itertools
+
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+
+from lote import COLUNAS_TOTAIS, normaliza_ativo, linha_totais
+from historico import rotulo_iso
+from paralelo import processar_ativos
+
+# #######################################
+# Planilhas grandes em fluxo (memória constante)
+# #######################################
+# A entrada é lida em blocos de linhas (pandas chunksize no CSV, openpyxl
+# read_only no XLSX), cada bloco é calculado e as linhas de saída são escritas
+# na hora (csv.writer / openpyxl write_only). Nada guarda o arquivo inteiro:
+# a memória depende do tamanho do bloco, não do número de linhas.
+FORMATOS_PLANILHA = ("csv", "xlsx")
+LINHAS_POR_BLOCO = int(os.environ.get("LMCALC_LINHAS_BLOCO", 1000))
+
+# Máximo de linhas de uma aba no Excel; acima disso a saída continua em outra aba
+LINHAS_POR_ABA_XLSX = 1_048_576
+
+COLUNAS_HISTORICO = [
+    "linha", "Nome Completo", "Mês", "Principal Líquido", "Juros",
+    "Desconto Previdenciário", "Desconto Assistência médica", "Juros Punitivos", "Valor Total do Ativo"
+]
+
+def formato_arquivo(nome_arquivo):
+    """'csv' ou 'xlsx' pela extensão; ValueError nas demais."""
+    ext = os.path.splitext(nome_arquivo or "")[1].lower()
+    if ext in (".xlsx", ".xlsm"):
+        return "xlsx"
+    if ext == ".csv":
+        return "csv"
+    raise ValueError(f"Extensão não suportada: {ext or nome_arquivo}. Use .csv ou .xlsx")
+
+def _separador_csv(arquivo):
+    """Detecta ',' ou ';' pela 1ª linha e volta o arquivo ao início."""
+    inicio = arquivo.tell()
+    primeira = arquivo.readline()
+    arquivo.seek(inicio)
+    if isinstance(primeira, bytes):
+        primeira = primeira.decode("utf-8-sig", errors="replace")
+    try:
+        return csv.Sniffer().sniff(primeira, delimiters=",;\t|").delimiter
+    except csv.Error:
+        return ","
+
+def blocos_csv(arquivo, tamanho):
+    """Listas de até `tamanho` ativos de um CSV."""
+    sep = _separador_csv(arquivo)
+    for df in pd.read_csv(arquivo, sep=sep, encoding="utf-8-sig", chunksize=tamanho):
+        yield [normaliza_ativo(row) for row in df.to_dict(orient="records")]
+
+def blocos_xlsx(arquivo, tamanho):
+    """Listas de até `tamanho` ativos da 1ª aba de um XLSX (openpyxl em modo read_only)."""
+    wb = load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        linhas = wb.worksheets[0].iter_rows(values_only=True)
+        cabecalho = next(linhas, None)
+        if cabecalho is None:
+            return
+        nomes = [str(c) if c is not None else f"Unnamed: {j}" for j, c in enumerate(cabecalho)]
+        linhas = (row for row in linhas if any(v is not None for v in row))  # pula linhas em branco
+        while True:
+            bloco = list(itertools.islice(linhas, tamanho))
+            if not bloco:
+                return
+            yield [normaliza_ativo(dict(zip(nomes, row))) for row in bloco]
+    finally:
+        wb.close()
+
+def blocos_ativos(arquivo, nome_arquivo, tamanho=None):
+    """Ativos do arquivo em blocos, pelo formato da extensão."""
+    tamanho = tamanho or LINHAS_POR_BLOCO
+    if formato_arquivo(nome_arquivo) == "xlsx":
+        return blocos_xlsx(arquivo, tamanho)
+    return blocos_csv(arquivo, tamanho)
+
+def linhas_historico(i, resultado):
+    """Linhas mensais (normal + punitivo) de um ativo para a saída com histórico."""
+    historico = resultado["historico"]
+    punitivo = historico.punitivo_ou_zeros()
+    total = historico.soma_normal() + punitivo
+    nome = resultado["nome_ativo"]
+    return [
+        [i, nome, rotulo_iso(o), round(p_, 2), round(j_, 2), round(dp_, 2), round(da_, 2), round(pun, 2), round(t_, 2)]
+        for o, (p_, j_, dp_, da_), pun, t_ in zip(
+            historico.ordinais.tolist(), historico.valores.tolist(), punitivo.tolist(), total.tolist()
+        )
+    ]
+
+class EscritorCSV:
+    """
+    Escreve os totais (e, opcionalmente, o histórico em outro arquivo) em CSV
+    UTF-8 com BOM, como csv_totais. Os destinos são arquivos binários abertos.
+    """
+
+    def __init__(self, destino_totais, destino_historico=None):
+        self.com_historico = destino_historico is not None
+        self._saidas = []
+        self._totais = self._abrir(destino_totais, COLUNAS_TOTAIS)
+        self._historico = self._abrir(destino_historico, COLUNAS_HISTORICO) if self.com_historico else None
+
+    def _abrir(self, destino, colunas):
+        texto = io.TextIOWrapper(destino, encoding="utf-8-sig", newline="")
+        self._saidas.append(texto)
+        writer = csv.writer(texto)
+        writer.writerow(colunas)
+        return writer
+
+    def totais(self, linha):
+        self._totais.writerow([linha[c] for c in COLUNAS_TOTAIS])
+
+    def historico(self, linhas):
+        self._historico.writerows(linhas)
+
+    def fechar(self):
+        # detach: quem abriu o destino é quem o fecha
+        for texto in self._saidas:
+            texto.flush()
+            texto.detach()
+        self._saidas = []
+
+class EscritorXLSX:
+    """
+    Escreve as abas "Totais" e, opcionalmente, "Histórico" com openpyxl write_only.
+    Aba que chega a `linhas_por_aba` (o limite do Excel) continua em "Histórico 2",
+    "Histórico 3"..., cada uma com o cabeçalho.
+    """
+
+    def __init__(self, destino, historico=False, linhas_por_aba=LINHAS_POR_ABA_XLSX):
+        self.destino = destino
+        self.com_historico = historico
+        self.linhas_por_aba = linhas_por_aba
+        self._wb = Workbook(write_only=True)
+        self._abas = {}  # nome -> [aba atual, colunas, linhas na aba, nº da aba]
+        self._nova_aba("Totais", COLUNAS_TOTAIS)
+        if historico:
+            self._nova_aba("Histórico", COLUNAS_HISTORICO)
+
+    def _nova_aba(self, nome, colunas, numero=1):
+        aba = self._wb.create_sheet(nome if numero == 1 else f"{nome} {numero}")
+        aba.append(colunas)
+        self._abas[nome] = [aba, colunas, 1, numero]
+
+    def _anexar(self, nome, linha):
+        estado = self._abas[nome]
+        if estado[2] >= self.linhas_por_aba:
+            self._nova_aba(nome, estado[1], estado[3] + 1)
+            estado = self._abas[nome]
+        estado[0].append(linha)
+        estado[2] += 1
+
+    def totais(self, linha):
+        self._anexar("Totais", [linha[c] for c in COLUNAS_TOTAIS])
+
+    def historico(self, linhas):
+        for linha in linhas:
+            self._anexar("Histórico", linha)
+
+    def fechar(self):
+        self._wb.save(self.destino)
+
+def processar_planilha(arquivo, nome_arquivo, escritor, final_date, tabelas, tamanho=None):
+    """
+    Calcula todos os ativos do arquivo bloco a bloco, escrevendo cada linha de
+    saída assim que o bloco termina. Retorna (total de ativos, ativos com erro).
+    """
+    modo = "historico" if escritor.com_historico else "totais"
+    total = erros = 0
+    for bloco in blocos_ativos(arquivo, nome_arquivo, tamanho):
+        for ativo, (resultado, erro) in zip(bloco, processar_ativos(bloco, final_date, tabelas, modo=modo)):
+            total += 1
+            erros += erro is not None
+            escritor.totais(linha_totais(total, ativo, resultado, erro))
+            if escritor.com_historico and resultado is not None:
+                escritor.historico(linhas_historico(total, resultado))
+    escritor.fechar()
+    return total, erros
+
+if __name__ == "__main__":
+    # python fluxo_lote.py entrada.(csv|xlsx) saida.(csv|xlsx) [--historico]
+    # No CSV o histórico vai para <saida>_historico.csv.
+    import argparse
+    from app import mes_atual
+    from tabelas import registro_tabelas
+
+    parser = argparse.ArgumentParser(description="Calcula uma planilha de ativos em fluxo, com memória constante.")
+    parser.add_argument("entrada")
+    parser.add_argument("saida")
+    parser.add_argument("--historico", action="store_true", help="inclui o histórico mensal de cada ativo")
+    args = parser.parse_args()
+
+    formato_saida = formato_arquivo(args.saida)
+    with open(args.entrada, "rb") as entrada, open(args.saida, "wb") as saida:
+        if formato_saida == "xlsx":
+            escritor = EscritorXLSX(saida, historico=args.historico)
+            total, erros = processar_planilha(entrada, args.entrada, escritor, mes_atual(), registro_tabelas.atual())
+        else:
+            hist = open(f"{os.path.splitext(args.saida)[0]}_historico.csv", "wb") if args.historico else None
+            try:
+                escritor = EscritorCSV(saida, hist)
+                total, erros = processar_planilha(entrada, args.entrada, escritor, mes_atual(), registro_tabelas.atual())
+            finally:
+                if hist is not None:
+                    hist.close()
+    print(f"{total} ativos calculados ({erros} com erro) -> {args.saida}", file=sys.stderr)
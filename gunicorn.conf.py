@@ -0,0 +1,64 @@
+# #######################################
+# Configuração do gunicorn (produção)
+# #######################################
+# gunicorn -c gunicorn.conf.py wsgi:app
+#
+# preload_app carrega app.py (e as tabelas) uma vez no mestre; os workers
+# nascem por fork e compartilham essa memória em copy-on-write. Os pools de
+# cálculo de cada worker saem de um forkserver (paralelo.py), não de fork.
+import os
+import glob
+import math
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+# Cálculo e PDF seguram o GIL: processos escalam, threads cobrem a espera de I/O.
+#
+# Os núcleos são divididos entre os workers web e o pool "lote" de cada um
+# (paralelo.py: núcleos // workers, no mínimo 2). Mais workers web atendem
+# mais /calcular simultâneos, mas cada /calcular/lote fica com menos núcleos;
+# um worker por núcleo deixaria o lote em série. O padrão, raiz dos núcleos
+# (no mínimo 2), equilibra os dois: 16 núcleos => 4 workers com lote de 4
+# processos. Quem só recebe /calcular avulsos pode subir LMCALC_WEB_WORKERS;
+# quem recebe lotes grandes, baixar (ou fixar LMCALC_WORKERS).
+#
+# Os jobs (/jobs) não entram nessa conta: um só executa por vez no cluster,
+# num pool com todos os núcleos (LMCALC_WORKERS_JOBS) e nice maior
+# (LMCALC_JOBS_NICE), que cede a CPU ao lote e às requisições.
+workers = int(os.environ.get("LMCALC_WEB_WORKERS", max(2, math.isqrt(os.cpu_count() or 1))))
+# Lido por paralelo.py (no preload): os pools "lote" de cada worker dividem os núcleos
+os.environ["LMCALC_WEB_WORKERS"] = str(workers)
+threads = int(os.environ.get("LMCALC_WEB_THREADS", 4))
+worker_class = "gthread" if threads > 1 else "sync"
+
+# Tempo máximo de uma requisição e prazo para terminar as em andamento no SIGTERM
+timeout = int(os.environ.get("LMCALC_WEB_TIMEOUT", 120))
+graceful_timeout = int(os.environ.get("LMCALC_WEB_GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+
+# Recicla workers de tempos em tempos (0 desliga), com jitter para não reiniciarem juntos
+max_requests = int(os.environ.get("LMCALC_WEB_MAX_REQUESTS", 0))
+max_requests_jitter = max_requests // 10
+
+preload_app = True
+accesslog = "-" if os.environ.get("LMCALC_WEB_ACCESSLOG") == "1" else None
+
+# /metrics cai num worker qualquer: cada worker grava os seus contadores neste
+# diretório e quem responde soma todos (metricas.py). Estados de uma subida
+# anterior do mestre são apagados, para os totais recomeçarem do zero.
+if os.environ.get("LMCALC_METRICAS_DIR"):
+    for estado in glob.glob(os.path.join(os.environ["LMCALC_METRICAS_DIR"], "*.json")):
+        os.remove(estado)
+else:
+    os.environ["LMCALC_METRICAS_DIR"] = tempfile.mkdtemp(prefix="lmcalc_metricas_")
+
+def post_fork(server, worker):
+    # Threads do mestre não existem no worker: monitor das tabelas e jobs sobem aqui
+    from app import iniciar_processo
+    iniciar_processo()
+
+def worker_exit(server, worker):
+    # Job em andamento volta para a fila; pools de cálculo são fechados
+    from app import encerrar_processo
+    encerrar_processo()
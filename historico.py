@@ -0,0 +1,58 @@
+import numpy as np
+
+# #######################################
+# Histórico mensal compacto de um ativo
+# #######################################
+# O histórico fica como o motor o produz: ordinais dos meses (int64), os 4
+# valores por mês (float64, meses x 4, na ordem de motor.VARIAVEIS) e o
+# acumulado dos juros punitivos (ou None). Nada de dict por mês nem de
+# Timestamp como chave: rótulos de data e linhas de tabela são montados só na
+# saída (JSON, PDF, planilha), direto dos arrays.
+
+def rotulo_iso(ordinal):
+    """Ordinal do mês -> "AAAA-MM-01"."""
+    return f"{ordinal // 12:04d}-{ordinal % 12 + 1:02d}-01"
+
+def rotulo_br(ordinal):
+    """Ordinal do mês -> "MM/AAAA"."""
+    return f"{ordinal % 12 + 1:02d}/{ordinal // 12:04d}"
+
+class Historico:
+    """Meses (ordinais), valores normais (meses x 4) e punitivo acumulado (meses,) ou None."""
+
+    __slots__ = ("ordinais", "valores", "punitivo")
+
+    def __init__(self, ordinais, valores, punitivo=None):
+        self.ordinais = ordinais
+        self.valores = valores
+        self.punitivo = punitivo
+
+    def __len__(self):
+        return len(self.ordinais)
+
+    def soma_normal(self):
+        """Principal + Juros + descontos por mês (mesma ordem de soma de sempre)."""
+        v = self.valores
+        return v[:, 0] + v[:, 1] + v[:, 2] + v[:, 3]
+
+    def punitivo_ou_zeros(self):
+        """Punitivo acumulado por mês; zeros quando não se aplica."""
+        return self.punitivo if self.punitivo is not None else np.zeros(len(self))
+
+    def finais(self):
+        """(valor normal, juros punitivos) no último mês; (0.0, 0.0) se vazio."""
+        if not len(self):
+            return 0.0, 0.0
+        p_, j_, dp_, da_ = self.valores[-1].tolist()
+        return p_ + j_ + dp_ + da_, (float(self.punitivo[-1]) if self.punitivo is not None else 0.0)
+
+    def anual(self):
+        """Só o último mês de cada ano (dezembro ou o mês final), como outro Historico."""
+        if not len(self):
+            return self
+        ultimo = (self.ordinais % 12 == 11)
+        ultimo[-1] = True
+        return Historico(
+            self.ordinais[ultimo], self.valores[ultimo],
+            self.punitivo[ultimo] if self.punitivo is not None else None,
+        )
@@ -0,0 +1,299 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+import pandas as pd
+
+from tabelas import BASE_DIR, registro_tabelas
+from paralelo import NUCLEOS, encerrar_pool, processar_ativos
+from lote import linha_totais
+
+# #######################################
+# Jobs em segundo plano (SQLite)
+# #######################################
+# Lotes grandes (dezenas de milhares de ativos) não cabem numa requisição: o
+# job é gravado no SQLite com um item por ativo e executado por uma thread do
+# processo web que distribui os ativos num pool de processos próprio ("jobs"),
+# separado do usado por /calcular/lote. Cada resultado é gravado assim que
+# fica pronto, então o progresso e o download parcial sobrevivem a reinícios.
+#
+# Todos os workers web consomem a mesma fila, mas só um job executa por vez no
+# cluster: o pool "jobs" existe num único processo, usa todos os núcleos da
+# máquina (com prioridade menor que a do lote, ver paralelo.py) e é fechado
+# quando a fila esvazia.
+CAMINHO_JOBS = os.environ.get("LMCALC_JOBS", os.path.join(BASE_DIR, "jobs.sqlite"))
+WORKERS_JOBS = int(os.environ.get("LMCALC_WORKERS_JOBS", NUCLEOS))
+
+MODOS_JOB = ("totais", "pdf")
+
+# Progresso é gravado a cada N itens ou T segundos (o que vier primeiro)
+GRAVAR_A_CADA_ITENS = 50
+GRAVAR_A_CADA_S = 1.0
+
+# Job "executando" sem sinal de vida por esse tempo é retomado por outro processo
+LIMITE_SEM_SINAL_S = int(os.environ.get("LMCALC_JOBS_SEM_SINAL_S", 300))
+
+class ArmazemJobs:
+    """Jobs e itens no SQLite; uma conexão por thread/processo (como os checkpoints)."""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._local = threading.local()
+
+    def _conexao(self):
+        con = getattr(self._local, "con", None)
+        if con is None or getattr(self._local, "pid", None) != os.getpid():
+            con = sqlite3.connect(self.caminho, timeout=30)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.executescript(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    modo TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    final_date TEXT NOT NULL,
+                    versao_tabelas TEXT,
+                    total INTEGER NOT NULL,
+                    feitos INTEGER NOT NULL DEFAULT 0,
+                    falhas INTEGER NOT NULL DEFAULT 0,
+                    criado_em REAL NOT NULL,
+                    iniciado_em REAL,
+                    concluido_em REAL,
+                    sinal_em REAL,
+                    erro TEXT
+                );
+                CREATE TABLE IF NOT EXISTS itens (
+                    job_id TEXT NOT NULL,
+                    linha INTEGER NOT NULL,
+                    ativo TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'fila',
+                    totais TEXT,
+                    nome_pdf TEXT,
+                    pdf BLOB,
+                    erro TEXT,
+                    PRIMARY KEY (job_id, linha)
+                );"""
+            )
+            self._local.con, self._local.pid = con, os.getpid()
+        return con
+
+    def criar(self, ativos, modo, final_date):
+        """Grava o job e seus itens na fila. Retorna o id."""
+        job_id = uuid.uuid4().hex
+        con = self._conexao()
+        with con:
+            con.execute(
+                "INSERT INTO jobs (id, modo, status, final_date, total, criado_em) VALUES (?, ?, 'fila', ?, ?, ?)",
+                (job_id, modo, final_date.strftime("%Y-%m-%d"), len(ativos), time.time()),
+            )
+            con.executemany(
+                "INSERT INTO itens (job_id, linha, ativo) VALUES (?, ?, ?)",
+                ((job_id, i, json.dumps(ativo, ensure_ascii=False, default=str))
+                 for i, ativo in enumerate(ativos, start=1)),
+            )
+        return job_id
+
+    def obter(self, job_id):
+        """Linha do job como dict, ou None."""
+        con = self._conexao()
+        cur = con.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        return dict(zip([c[0] for c in cur.description], row))
+
+    def reservar_proximo(self):
+        """
+        Marca como "executando" o job mais antigo da fila (ou abandonado por um
+        processo que parou de dar sinal) e o retorna; None se não houver ou se
+        outro processo já estiver executando um job (um por vez no cluster).
+        """
+        con = self._conexao()
+        agora = time.time()
+        limite = agora - LIMITE_SEM_SINAL_S
+        with con:
+            row = con.execute(
+                """SELECT id FROM jobs
+                   WHERE status = 'fila' OR (status = 'executando' AND sinal_em < ?)
+                   ORDER BY criado_em LIMIT 1""",
+                (limite,),
+            ).fetchone()
+            if row is None:
+                return None
+            # Num só UPDATE: a checagem do job ativo e a reserva não se intercalam com outro processo
+            cur = con.execute(
+                """UPDATE jobs SET status = 'executando', sinal_em = ?,
+                   iniciado_em = COALESCE(iniciado_em, ?)
+                   WHERE id = ? AND (status = 'fila' OR (status = 'executando' AND sinal_em < ?))
+                   AND NOT EXISTS (SELECT 1 FROM jobs WHERE status = 'executando' AND sinal_em >= ?)""",
+                (agora, agora, row[0], limite, limite),
+            )
+            if cur.rowcount != 1:
+                return None  # outro processo reservou antes ou está executando um job
+        return self.obter(row[0])
+
+    def itens_pendentes(self, job_id):
+        """[(linha, ativo)] ainda não calculados, em ordem."""
+        rows = self._conexao().execute(
+            "SELECT linha, ativo FROM itens WHERE job_id = ? AND status = 'fila' ORDER BY linha", (job_id,)
+        ).fetchall()
+        return [(linha, json.loads(ativo)) for linha, ativo in rows]
+
+    def gravar_itens(self, job_id, itens, versao):
+        """Grava um bloco de resultados [(linha, status, totais, nome_pdf, pdf, erro)] e o progresso."""
+        con = self._conexao()
+        ok = sum(1 for x in itens if x[1] == "ok")
+        with con:
+            con.executemany(
+                "UPDATE itens SET status = ?, totais = ?, nome_pdf = ?, pdf = ?, erro = ? WHERE job_id = ? AND linha = ?",
+                ((st, totais, nome_pdf, pdf, erro, job_id, linha) for linha, st, totais, nome_pdf, pdf, erro in itens),
+            )
+            con.execute(
+                """UPDATE jobs SET feitos = feitos + ?, falhas = falhas + ?, sinal_em = ?,
+                   versao_tabelas = ? WHERE id = ?""",
+                (ok, len(itens) - ok, time.time(), versao, job_id),
+            )
+
+    def tem_pendentes(self):
+        """Há job na fila ou em execução (talvez de um processo que parou)?"""
+        row = self._conexao().execute(
+            "SELECT 1 FROM jobs WHERE status IN ('fila', 'executando') LIMIT 1"
+        ).fetchone()
+        return row is not None
+
+    def devolver_para_fila(self, job_id):
+        """Job interrompido (desligamento): volta para a fila e é retomado dos itens pendentes."""
+        con = self._conexao()
+        with con:
+            con.execute("UPDATE jobs SET status = 'fila' WHERE id = ? AND status = 'executando'", (job_id,))
+
+    def finalizar(self, job_id, status, erro=None):
+        con = self._conexao()
+        with con:
+            con.execute(
+                "UPDATE jobs SET status = ?, erro = ?, concluido_em = ?, sinal_em = ? WHERE id = ?",
+                (status, erro, time.time(), time.time(), job_id),
+            )
+
+    def resultados(self, job_id, com_pdf=False):
+        """Itens já processados, em ordem: (linha, ativo, totais, nome_pdf, pdf, erro)."""
+        colunas = "linha, ativo, totais, nome_pdf, pdf, erro" if com_pdf else "linha, ativo, totais, nome_pdf, NULL, erro"
+        cur = self._conexao().execute(
+            f"SELECT {colunas} FROM itens WHERE job_id = ? AND status != 'fila' ORDER BY linha", (job_id,)
+        )
+        for linha, ativo, totais, nome_pdf, pdf, erro in cur:
+            yield linha, json.loads(ativo), (json.loads(totais) if totais else None), nome_pdf, pdf, erro
+
+def progresso_job(job):
+    """Resumo do job para o cliente: contagens, vazão (ativos/s) e ETA em segundos."""
+    processados = job["feitos"] + job["falhas"]
+    vazao = eta = None
+    if job["iniciado_em"]:
+        fim = job["concluido_em"] or time.time()
+        decorrido = max(fim - job["iniciado_em"], 1e-6)
+        if processados:
+            vazao = processados / decorrido
+            if job["status"] == "executando":
+                eta = (job["total"] - processados) / vazao
+    return {
+        "job_id": job["id"],
+        "modo": job["modo"],
+        "status": job["status"],
+        "total": job["total"],
+        "feitos": job["feitos"],
+        "falhas": job["falhas"],
+        "pendentes": job["total"] - processados,
+        "ativos_por_segundo": round(vazao, 2) if vazao is not None else None,
+        "eta_segundos": round(eta, 1) if eta is not None else None,
+        "versao_tabelas": job["versao_tabelas"],
+        "erro": job["erro"],
+    }
+
+class ExecutorJobs:
+    """Thread que consome a fila de jobs, um job por vez no cluster, no pool "jobs"."""
+
+    def __init__(self, armazem, workers=None):
+        self.armazem = armazem
+        self.workers = workers or WORKERS_JOBS
+        self._acordar = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+
+    def iniciar(self):
+        """Sobe a thread (uma por processo); chamadas repetidas só a acordam."""
+        with self._lock:
+            # Após um fork a thread do processo pai não existe no filho
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._parar.clear()
+                self._thread = threading.Thread(target=self._loop, name="lmcalc-jobs", daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+        self._acordar.set()
+
+    def parar(self, espera=30):
+        """
+        Desligamento gracioso: o job em andamento grava o que já terminou e volta
+        para a fila (outro processo, ou este ao voltar, continua dos pendentes).
+        """
+        self._parar.set()
+        self._acordar.set()
+        thread = self._thread
+        if thread is not None and self._pid == os.getpid() and thread.is_alive():
+            thread.join(espera)
+
+    def _loop(self):
+        while not self._parar.is_set():
+            job = self.armazem.reservar_proximo()
+            if job is None:
+                # Fila vazia (ou job em outro processo): libera os núcleos do pool
+                encerrar_pool("jobs")
+                self._acordar.wait(LIMITE_SEM_SINAL_S / 2)
+                self._acordar.clear()
+                continue
+            try:
+                self.executar(job)
+            except Exception as e:
+                self.armazem.finalizar(job["id"], "falhou", f"Erro no job: {e}")
+
+    def executar(self, job):
+        """Calcula os itens pendentes do job, gravando os resultados em blocos."""
+        tabelas = registro_tabelas.atual()
+        final_date = pd.Timestamp(job["final_date"])
+        pendentes = self.armazem.itens_pendentes(job["id"])
+        ativos = [ativo for _, ativo in pendentes]
+        resultados = processar_ativos(
+            ativos, final_date, tabelas, modo=job["modo"],
+            workers=self.workers, nome_pool="jobs", local=False,
+        )
+        bloco, ultimo = [], time.monotonic()
+        for (linha, ativo), (resultado, erro) in zip(pendentes, resultados):
+            bloco.append(self._item(job["modo"], linha, ativo, resultado, erro))
+            if len(bloco) >= GRAVAR_A_CADA_ITENS or time.monotonic() - ultimo >= GRAVAR_A_CADA_S:
+                self.armazem.gravar_itens(job["id"], bloco, tabelas.versao)
+                bloco, ultimo = [], time.monotonic()
+            if self._parar.is_set():
+                break
+        if bloco:
+            self.armazem.gravar_itens(job["id"], bloco, tabelas.versao)
+        if self._parar.is_set():
+            self.armazem.devolver_para_fila(job["id"])
+        else:
+            self.armazem.finalizar(job["id"], "concluido")
+
+    @staticmethod
+    def _item(modo, linha, ativo, resultado, erro):
+        if erro:
+            return linha, "erro", None, None, None, erro
+        if modo == "pdf":
+            nome_pdf, conteudo = resultado
+            return linha, "ok", None, nome_pdf, conteudo, None
+        totais = linha_totais(linha, ativo, resultado, None)
+        return linha, "ok", json.dumps(totais, ensure_ascii=False, default=str), None, None, None
+
+armazem_jobs = ArmazemJobs(CAMINHO_JOBS)
+executor_jobs = ExecutorJobs(armazem_jobs)
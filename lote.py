@@ -0,0 +1,153 @@
+import os
+import json
+import zipfile
+from datetime import date
+from io import BytesIO
+
+import pandas as pd
+
+# #######################################
+# Entrada e saída do cálculo em lote
+# #######################################
+FORMATOS_LOTE = ("zip", "json", "csv")
+
+COLUNAS_TOTAIS = [
+    "linha", "Nome Completo", "Ordem Cronológica", "Data Base",
+    "Valor Normal", "Juros Punitivos", "Valor Total do Ativo", "versao_tabelas", "erro"
+]
+
+def normaliza_ativo(row):
+    """
+    Ajusta uma linha de planilha/JSON para o formato que calcular_ativo espera:
+    células vazias (NaN/NaT) => None, datas => 'AAAA-MM-DD', OC numérica => texto.
+    """
+    ativo = {}
+    for k, v in row.items():
+        if v is pd.NaT or (isinstance(v, float) and pd.isna(v)):
+            v = None
+        elif isinstance(v, date):  # pd.Timestamp, datetime (openpyxl) ou date
+            v = v.strftime("%Y-%m-%d")
+        ativo[str(k).strip()] = v
+    oc = ativo.get("Ordem Cronológica")
+    if isinstance(oc, (int, float)) and not isinstance(oc, bool):
+        ativo["Ordem Cronológica"] = str(int(oc))
+    return ativo
+
+def ler_ativos_json(data):
+    """Lista de ativos a partir do corpo JSON. Retorna (ativos, erro)."""
+    if not isinstance(data, list) or not data:
+        return None, "Formato JSON inválido. Esperamos uma lista de objetos com os campos do ativo"
+    if not all(isinstance(x, dict) for x in data):
+        return None, "Formato JSON inválido. Cada item da lista deve ser um objeto"
+    return [normaliza_ativo(x) for x in data], None
+
+def ler_tabela_ativos(arquivo, nome_arquivo):
+    """Lê um CSV/XLSX de ativos como DataFrame, pela extensão do arquivo."""
+    ext = os.path.splitext(nome_arquivo or "")[1].lower()
+    if ext in (".xlsx", ".xls"):
+        return pd.read_excel(arquivo)
+    if ext == ".csv":
+        # Separador detectado (',' ou ';' de planilhas em português)
+        return pd.read_csv(arquivo, sep=None, engine="python", encoding="utf-8-sig")
+    raise ValueError(f"Extensão não suportada: {ext or nome_arquivo}. Use .csv ou .xlsx")
+
+def ler_ativos_arquivo(arquivo):
+    """Lista de ativos a partir de um upload CSV/XLSX. Retorna (ativos, erro)."""
+    try:
+        df = ler_tabela_ativos(arquivo, arquivo.filename)
+    except ValueError as e:
+        return None, str(e)
+    except Exception as e:
+        return None, f"Não foi possível ler o arquivo: {e}"
+    if df.empty:
+        return None, "Arquivo sem ativos"
+    return [normaliza_ativo(row) for row in df.to_dict(orient="records")], None
+
+def linha_totais(i, ativo, resultado, erro):
+    """Linha de totais de um ativo do lote (i começa em 1)."""
+    linha = {
+        "linha": i,
+        "Nome Completo": ativo.get("Nome Completo"),
+        "Ordem Cronológica": ativo.get("Ordem Cronológica"),
+        "Data Base": ativo.get("Data Base"),
+        "Valor Normal": None,
+        "Juros Punitivos": None,
+        "Valor Total do Ativo": None,
+        "versao_tabelas": None,
+        "erro": erro,
+    }
+    if resultado is not None:
+        linha["Ordem Cronológica"] = resultado["ordem_cronologica"]
+        linha["Data Base"] = resultado["data_base"].strftime("%Y-%m-%d")
+        linha["Valor Normal"] = round(resultado["valor_normal_final"], 2)
+        linha["Juros Punitivos"] = round(resultado["valor_punitivo_final"], 2)
+        linha["Valor Total do Ativo"] = round(resultado["valor_total_final"], 2)
+        linha["versao_tabelas"] = resultado["versao_tabelas"]
+    return linha
+
+def linhas_totais(ativos, resultados):
+    """Linhas de totais do lote, na ordem de entrada."""
+    return [
+        linha_totais(i, ativo, resultado, erro)
+        for i, (ativo, (resultado, erro)) in enumerate(zip(ativos, resultados), start=1)
+    ]
+
+def csv_totais(linhas):
+    """CSV (UTF-8 com BOM, para abrir direto no Excel) com as linhas de totais."""
+    buf = BytesIO()
+    pd.DataFrame(linhas, columns=COLUNAS_TOTAIS).to_csv(buf, index=False, encoding="utf-8-sig")
+    buf.seek(0)
+    return buf
+
+def nome_unico(nome, nomes_usados):
+    """Evita nomes repetidos dentro do ZIP: LMCalc_X.pdf, LMCalc_X_2.pdf, ..."""
+    base, ext = os.path.splitext(nome)
+    candidato, n = nome, 1
+    while candidato in nomes_usados:
+        n += 1
+        candidato = f"{base}_{n}{ext}"
+    nomes_usados.add(candidato)
+    return candidato
+
+class _SaidaFluxo:
+    """Destino só de escrita do ZipFile em fluxo: guarda os bytes até o próximo envio."""
+
+    def __init__(self):
+        self._partes = []
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def retirar(self):
+        dados = b"".join(self._partes)
+        self._partes = []
+        return dados
+
+def zip_pdfs_em_fluxo(itens):
+    """
+    ZIP com os PDFs do lote, gerado em pedaços de bytes para uma resposta em
+    fluxo: cada PDF sai assim que é gravado (destino sem seek => o zipfile usa
+    data descriptors) e o diretório central vai no último pedaço. Só um PDF
+    por vez fica em memória.
+
+    itens: (linha, ativo, pdf, erro) com pdf = (nome_final, bytes). Nomes
+    repetidos ganham sufixo; as falhas vão para erros.json.
+    """
+    saida = _SaidaFluxo()
+    with zipfile.ZipFile(saida, "w", zipfile.ZIP_DEFLATED) as zf:
+        nomes_usados = set()
+        erros = []
+        for i, ativo, pdf, erro in itens:
+            if erro:
+                erros.append({"linha": i, "Nome Completo": ativo.get("Nome Completo"), "erro": erro})
+                continue
+            nome_final, conteudo = pdf
+            zf.writestr(nome_unico(nome_final, nomes_usados), conteudo)
+            yield saida.retirar()
+        if erros:
+            zf.writestr("erros.json", json.dumps(erros, ensure_ascii=False, indent=2))
+    yield saida.retirar()
@@ -0,0 +1,297 @@
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+# #######################################
+# Métricas (formato Prometheus) e log estruturado
+# #######################################
+# Contadores e histogramas em memória, por processo, expostos em /metrics no
+# formato texto do Prometheus. Cada etapa do cálculo é medida com medir(etapa):
+# vai para o histograma lmcalc_etapa_segundos e para a lista de etapas da
+# requisição corrente, que o log estruturado grava numa linha JSON.
+#
+# Com vários processos web (gunicorn), o scrape cai num worker qualquer: com
+# compartilhar(diretorio) cada processo grava o seu estado num arquivo e
+# /metrics soma contadores e histogramas de todos. Medidores "gauge" (taxa de
+# acerto, itens em cache, carga das tabelas) são do processo que respondeu.
+log = logging.getLogger("lmcalc")
+# Mensagens de início (carga das tabelas): saem no stderr em INFO mesmo sem LMCALC_LOG
+log_inicio = logging.getLogger("lmcalc.inicio")
+
+BUCKETS_PADRAO = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _rotulos(nomes, valores):
+    if not nomes:
+        return ""
+    return "{" + ",".join(f'{n}="{_escapar(v)}"' for n, v in zip(nomes, valores)) + "}"
+
+def _numero(v):
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+class Contador:
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome, self.ajuda, self.rotulos = nome, ajuda, tuple(rotulos)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    somavel = True
+
+    def inc(self, *rotulos, valor=1):
+        with self._lock:
+            self._valores[rotulos] = self._valores.get(rotulos, 0) + valor
+
+    def valores(self):
+        with self._lock:
+            return dict(self._valores)
+
+    def texto(self, valores=None):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} counter"]
+        for rot, v in sorted((self.valores() if valores is None else valores).items()):
+            linhas.append(f"{self.nome}{_rotulos(self.rotulos, rot)} {_numero(v)}")
+        return linhas
+
+class Histograma:
+    somavel = True
+
+    def __init__(self, nome, ajuda, rotulos=(), buckets=BUCKETS_PADRAO):
+        self.nome, self.ajuda, self.rotulos = nome, ajuda, tuple(rotulos)
+        self.buckets = tuple(buckets)
+        self._series = {}  # rotulos -> [contagens por bucket..., soma, total]
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *rotulos):
+        i = bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(rotulos)
+            if serie is None:
+                serie = self._series[rotulos] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                serie[i] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def valores(self):
+        with self._lock:
+            return {rot: list(serie) for rot, serie in self._series.items()}
+
+    def texto(self, valores=None):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} histogram"]
+        nomes_le = self.rotulos + ("le",)
+        for rot, serie in sorted((self.valores() if valores is None else valores).items()):
+            acumulado = 0
+            for limite, n in zip(self.buckets, serie):
+                acumulado += n
+                linhas.append(f"{self.nome}_bucket{_rotulos(nomes_le, rot + (_numero(limite),))} {acumulado}")
+            linhas.append(f"{self.nome}_bucket{_rotulos(nomes_le, rot + ('+Inf',))} {serie[-1]}")
+            linhas.append(f"{self.nome}_sum{_rotulos(self.rotulos, rot)} {repr(serie[-2])}")
+            linhas.append(f"{self.nome}_count{_rotulos(self.rotulos, rot)} {serie[-1]}")
+        return linhas
+
+class Medidor:
+    """
+    Valor lido na hora da coleta (taxa de acerto de cache, carga das tabelas...).
+    `ler` devolve um número ou {rotulos: número}; tipo "counter" para totais já
+    contados em outro lugar (acertos do CacheLRU, por exemplo).
+    """
+
+    def __init__(self, nome, ajuda, ler, rotulos=(), tipo="gauge"):
+        self.nome, self.ajuda, self.ler, self.rotulos, self.tipo = nome, ajuda, ler, tuple(rotulos), tipo
+        self.somavel = tipo == "counter"
+
+    def valores(self):
+        valores = self.ler()
+        if not isinstance(valores, dict):
+            valores = {(): valores}
+        return {(rot if isinstance(rot, tuple) else (rot,)): v for rot, v in valores.items()}
+
+    def texto(self, valores=None):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}"]
+        for rot, v in sorted((self.valores() if valores is None else valores).items()):
+            linhas.append(f"{self.nome}{_rotulos(self.rotulos, rot)} {_numero(v)}")
+        return linhas
+
+def _somar(a, b):
+    """Soma valores de métrica: números (contadores) ou listas (séries de histograma)."""
+    if isinstance(a, list):
+        return [x + y for x, y in zip(a, b)]
+    return a + b
+
+class Registro:
+    """Conjunto de métricas do processo, na ordem em que foram criadas."""
+
+    def __init__(self):
+        self._metricas = []
+        self.diretorio = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def registrar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def compartilhar(self, diretorio, intervalo=1.0):
+        """
+        Liga a soma entre processos: uma thread deste processo grava o estado das
+        métricas somáveis em `diretorio` a cada `intervalo` s (ver gravar_estado).
+        Chamadas repetidas no mesmo processo não sobem outra thread.
+        """
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            os.makedirs(diretorio, exist_ok=True)
+            self.diretorio, self._pid = diretorio, os.getpid()
+            self._thread = threading.Thread(target=self._gravar_periodicamente, args=(intervalo,),
+                                            name="lmcalc-metricas", daemon=True)
+            self._thread.start()
+
+    def _gravar_periodicamente(self, intervalo):
+        while True:
+            time.sleep(intervalo)
+            self.gravar_estado()
+
+    def gravar_estado(self):
+        """
+        Grava <pid>.json com contadores e histogramas deste processo. O arquivo de
+        um worker que saiu fica: os totais somados não voltam para trás.
+        """
+        estado = {
+            m.nome: [[list(rot), v] for rot, v in m.valores().items()]
+            for m in self._metricas if m.somavel
+        }
+        caminho = os.path.join(self.diretorio, f"{os.getpid()}.json")
+        try:
+            tmp = f"{caminho}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(estado, f)
+            os.replace(tmp, caminho)
+        except OSError:
+            pass  # sem escrita: /metrics segue com o que os outros processos gravaram
+
+    def _somados(self):
+        """{nome: {rotulos: valor}} somado entre os arquivos de todos os processos."""
+        self.gravar_estado()
+        total = {}
+        for arquivo in os.listdir(self.diretorio):
+            if not arquivo.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.diretorio, arquivo), encoding="utf-8") as f:
+                    estado = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for nome, itens in estado.items():
+                serie = total.setdefault(nome, {})
+                for rot, v in itens:
+                    rot = tuple(rot)
+                    serie[rot] = _somar(serie[rot], v) if rot in serie else v
+        return total
+
+    def texto(self):
+        somados = self._somados() if self.diretorio else {}
+        linhas = []
+        for m in self._metricas:
+            linhas.extend(m.texto(somados.get(m.nome, {}) if self.diretorio and m.somavel else None))
+        return "\n".join(linhas) + "\n"
+
+metricas = Registro()
+
+requisicoes = metricas.registrar(Contador(
+    "lmcalc_requisicoes_total", "Requisições atendidas", ("rota", "metodo", "status")))
+latencia_requisicao = metricas.registrar(Histograma(
+    "lmcalc_requisicao_segundos", "Tempo total da requisição", ("rota",)))
+latencia_etapa = metricas.registrar(Histograma(
+    "lmcalc_etapa_segundos", "Tempo por etapa (validacao, normal, punitivo, pdf, envio)", ("etapa",)))
+ativos_calculados = metricas.registrar(Contador(
+    "lmcalc_ativos_calculados_total", "Ativos calculados, por resultado", ("resultado",)))
+
+# #######################################
+# Etapas da requisição
+# #######################################
+_etapas_requisicao = contextvars.ContextVar("lmcalc_etapas", default=None)
+
+def iniciar_requisicao():
+    """Começa a coletar as etapas da requisição corrente (thread/contexto atual)."""
+    etapas = {}
+    _etapas_requisicao.set(etapas)
+    return etapas
+
+def etapas_requisicao():
+    """Etapas medidas até agora na requisição: {etapa: segundos}."""
+    return _etapas_requisicao.get() or {}
+
+def encerrar_requisicao():
+    _etapas_requisicao.set(None)
+
+def somar_etapa(etapa, segundos, etapas=None):
+    """Registra a duração no histograma da etapa e nas `etapas` (padrão: as da requisição corrente)."""
+    latencia_etapa.observar(segundos, etapa)
+    if etapas is None:
+        etapas = _etapas_requisicao.get()
+    if etapas is not None:
+        etapas[etapa] = etapas.get(etapa, 0.0) + segundos
+
+@contextmanager
+def medir(etapa):
+    """Mede o bloco no histograma da etapa e soma na requisição corrente, se houver."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        somar_etapa(etapa, time.perf_counter() - t0)
+
+# #######################################
+# Log estruturado (JSON por linha, arquivo rotativo)
+# #######################################
+class FormatoJSON(logging.Formatter):
+    """Uma linha JSON por registro; campos extras vêm de `extra={"dados": {...}}`."""
+
+    def format(self, record):
+        linha = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)),
+            "nivel": record.levelname,
+            "msg": record.getMessage(),
+        }
+        linha.update(getattr(record, "dados", None) or {})
+        if record.exc_info:
+            linha["erro"] = self.formatException(record.exc_info)
+        return json.dumps(linha, ensure_ascii=False, default=str)
+
+def configurar_log(caminho, max_bytes=10 * 1024 * 1024, arquivos=5, nivel=logging.INFO):
+    """
+    Liga o log estruturado em `caminho` (RotatingFileHandler). Sem caminho, o
+    logger "lmcalc" só avisa WARNING+ no stderr, sem custo no caminho quente.
+    log_inicio tem o seu handler INFO no stderr e também passa pelos de "lmcalc".
+    """
+    log.setLevel(nivel if caminho else logging.WARNING)
+    log.propagate = False
+    for h in list(log.handlers):
+        log.removeHandler(h)
+        h.close()
+    if caminho:
+        handler = RotatingFileHandler(caminho, maxBytes=max_bytes, backupCount=arquivos, encoding="utf-8")
+        handler.setFormatter(FormatoJSON())
+        log.addHandler(handler)
+    else:
+        handler = logging.StreamHandler()
+        handler.setLevel(logging.WARNING)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+        log.addHandler(handler)
+
+    log_inicio.setLevel(logging.INFO)
+    for h in list(log_inicio.handlers):
+        log_inicio.removeHandler(h)
+        h.close()
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.INFO)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    log_inicio.addHandler(handler)
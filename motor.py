@@ -0,0 +1,355 @@
+import numpy as np
+
+from tabelas import registro_tabelas, ordinal_mes
+
+# #######################################
+# Constantes do cálculo
+# #######################################
+VARIAVEIS = ["Principal Líquido", "Juros", "Desconto Previdenciário", "Desconto Assistência médica"]
+COL_JUROS = VARIAVEIS.index("Juros")
+
+ORD_INICIO_SELIC = ordinal_mes(2022, 1)    # a partir daqui => SELIC simples
+ORD_DEZ_2021     = ordinal_mes(2021, 12)   # Juros com fator parcial (8/31)
+ORD_FIM_META_FIXA = ordinal_mes(2012, 5)   # até mai/2012 => 0,5% a.m. fixo
+
+def valores_iniciais(ativo):
+    """Lê as 4 variáveis do ativo como vetor float (None => 0.0, NaN é mantido)."""
+    out = np.zeros(len(VARIAVEIS))
+    for i, v_ in enumerate(VARIAVEIS):
+        val = ativo.get(v_, 0.0)
+        out[i] = 0.0 if val is None else float(val)
+    return out
+
+def janela_graca(oc):
+    """
+    Meses (ordinais) do período de graça da OC, em que se aplica o IPCA-E.
+
+    Retorna (inicio, fim, inicio_sem_correcao). Para OC < 2022 a graça começa
+    em jul/(OC-1) e o mês de início não é corrigido; para OC >= 2022 a data de
+    início é 03/04/(OC-1), logo o primeiro mês cheio é maio.
+    """
+    if oc < 2022:
+        return ordinal_mes(oc - 1, 7), ordinal_mes(oc, 12), True
+    return ordinal_mes(oc - 1, 5), ordinal_mes(oc, 12), False
+
+# #######################################
+# Plano do cálculo (o que vem das tabelas)
+# #######################################
+# Fatores, taxas e multiplicadores de cada mês dependem só do mês da Data Base,
+# da OC, do mês final e das tabelas, não dos valores do ativo. O plano junta
+# esses arrays; aplicá-lo aos valores faz as mesmas contas, na mesma ordem,
+# para qualquer ativo. coortes.py guarda um plano por coorte.
+def plano_calculo(ord_base, ord_final, oc, tabelas):
+    """
+    Plano de um (mês da Data Base, OC, mês final): dict com ordinais, n_pre
+    (meses antes de jan/2022), fatores (n_pre x 4) da atualização normal, taxas
+    SELIC (fração) dos meses seguintes e o plano dos juros punitivos (ou None).
+    """
+    n = max(ord_final - ord_base + 1, 0)
+    ordinais = np.arange(ord_base, ord_base + n, dtype=np.int64)
+    n_pre = int(np.clip(ORD_INICIO_SELIC - ord_base, 0, n))
+    plano = {"ordinais": ordinais, "n_pre": n_pre, "fatores": None, "taxas_selic": None, "punitivo": None}
+    if n == 0:
+        return plano
+
+    # 1) Trecho Tabela Prática / IPCA-E (meses < jan/2022)
+    if n_pre:
+        ords = ordinais[:n_pre]
+        g_ini, g_fim, ini_sem_correcao = janela_graca(oc)
+        na_graca = (ords >= g_ini) & (ords <= g_fim)
+
+        fator = tabelas.pratica.razoes_meses(ords)
+        fator[na_graca] = tabelas.ipcae.razoes_meses(ords[na_graca])
+        if ini_sem_correcao:
+            fator[ords == g_ini] = 1.0
+        fator[0] = 1.0  # mês da Data Base: anterior == atual
+
+        fatores = np.repeat(fator[:, None], len(VARIAVEIS), axis=1)
+        dez21 = (ords == ORD_DEZ_2021) & ~na_graca
+        fatores[dez21, COL_JUROS] = 1.0 + (fatores[dez21, COL_JUROS] - 1.0) * (8/31.0)
+        plano["fatores"] = fatores
+
+    # 2) Trecho SELIC (meses >= jan/2022)
+    if n_pre < n:
+        plano["taxas_selic"] = tabelas.selic.valores_meses(ordinais[n_pre:], padrao=0.0) / 100
+
+    plano["punitivo"] = _plano_punitivo(ordinais, oc, tabelas, plano["taxas_selic"])
+    return plano
+
+# #######################################
+# Atualização normal (vetorizada)
+# #######################################
+def serie_normal(valores, ord_base, ord_final, oc, tabelas=None):
+    """
+    Calcula a atualização normal de uma vez, mês a mês, de ord_base até ord_final.
+
+    Retorna (ordinais, historico) com historico de shape (meses, 4) na ordem de
+    VARIAVEIS. Até dez/2021 os valores são o produto acumulado dos fatores da
+    Tabela Prática (ou IPCA-E na graça); a partir de jan/2022 são juros simples
+    SELIC sobre a base congelada em dez/2021. Mesma ordem de operações do
+    cálculo mês a mês, logo o mesmo resultado centavo a centavo.
+    `tabelas` é um ConjuntoTabelas (padrão: o atual do registro).
+    """
+    tabelas = registro_tabelas.atual() if tabelas is None else tabelas
+    plano = plano_calculo(ord_base, ord_final, oc, tabelas)
+    historico, _ = aplicar_normal(valores, plano)
+    return plano["ordinais"], historico
+
+def aplicar_normal(valores, plano):
+    """Série normal (meses x 4) do plano + (base, acumulado) do trecho SELIC no último mês (ou None)."""
+    valores = np.asarray(valores, dtype=float)
+    n, n_pre = plano["ordinais"].size, plano["n_pre"]
+    historico = np.empty((n, len(VARIAVEIS)))
+    if n == 0:
+        return historico, None
+
+    if n_pre:
+        # Produto acumulado com o valor inicial na frente => mesma ordem de operações do loop
+        acumulado = np.multiply.accumulate(np.vstack([valores, plano["fatores"]]), axis=0)
+        historico[:n_pre] = acumulado[1:]
+
+    # Trecho SELIC: base congelada + soma das taxas
+    estado_selic = None
+    if n_pre < n:
+        base = historico[n_pre - 1].copy() if n_pre else valores
+        historico[n_pre:], acum = selic_normal(base, np.zeros_like(base), plano["taxas_selic"])
+        estado_selic = (base, acum[-1])
+
+    return historico, estado_selic
+
+def avancar_selic_normal(ordinais, base, acum_ini, tabelas):
+    """
+    Trecho SELIC da atualização normal a partir de um acumulado já existente.
+
+    Retorna (valores, acumulado) por mês: acumulado = acum_ini + soma de base x taxa,
+    somado mês a mês na mesma ordem do cálculo completo; valores = base + acumulado.
+    """
+    taxas = tabelas.selic.valores_meses(ordinais, padrao=0.0) / 100
+    return selic_normal(base, acum_ini, taxas)
+
+def selic_normal(base, acum_ini, taxas):
+    """
+    Trecho SELIC da atualização normal para taxas mensais dadas (fração).
+
+    taxas tem shape (meses,) ou (cenários, meses); o resultado ganha as mesmas
+    dimensões na frente de (meses, 4). Usado pelas tabelas e pelas projeções.
+    """
+    base = np.asarray(base, dtype=float)
+    incr = base * taxas[..., :, None]
+    inicio = np.broadcast_to(np.asarray(acum_ini, dtype=float), incr.shape[:-2] + (1, base.size))
+    acumulado = np.cumsum(np.concatenate([inicio, incr], axis=-2), axis=-2)[..., 1:, :]
+    return base + acumulado, acumulado
+
+# #######################################
+# Juros punitivos (vetorizado)
+# #######################################
+def _recorrencia(acum_ini, mult, incr):
+    """
+    a[t] = a[t-1] * mult[t] + incr[t] no último eixo (um acum_ini por linha
+    quando há vários cenários). Laço sequencial sobre os arrays já montados:
+    a mesma ordem de operações do cálculo mês a mês, bit a bit, e sem dividir
+    pelo produto acumulado (uma razão zero não vira NaN no resto da série).
+    """
+    mult, incr = np.broadcast_arrays(mult, incr)
+    if mult.ndim == 1:
+        # Floats do Python: mais rápido que indexar o array a cada mês
+        a, saida = float(acum_ini), []
+        for m, i in zip(mult.tolist(), incr.tolist()):
+            a = a * m + i
+            saida.append(a)
+        return np.array(saida, dtype=float)
+
+    saida = np.empty(mult.shape)
+    a = np.broadcast_to(np.asarray(acum_ini, dtype=float), mult.shape[:-1])
+    for t in range(mult.shape[-1]):
+        a = a * mult[..., t] + incr[..., t]
+        saida[..., t] = a
+    return saida
+
+def serie_punitiva(ordinais, historico, oc, tabelas=None):
+    """
+    Juros punitivos acumulados para cada mês da série normal (mesmos ordinais).
+
+    Retorna None quando não se aplicam (Data Base > dez/2021). Na graça o
+    acumulado é corrigido pelo IPCA-E; fora dela, até dez/2021, recebe a taxa da
+    meta SELIC (0,5% fixo até mai/2012) sobre Principal + descontos, somando os
+    meses fora da graça a cada fim de período de vigência, e é corrigido pela
+    Tabela Prática; a partir de jan/2022 são juros SELIC simples sobre o
+    acumulado congelado no primeiro mês fora da graça.
+    """
+    tabelas = registro_tabelas.atual() if tabelas is None else tabelas
+    ordinais = np.asarray(ordinais, dtype=np.int64)
+    n_pre = int((ordinais < ORD_INICIO_SELIC).sum())
+    taxas = tabelas.selic.valores_meses(ordinais[n_pre:], padrao=0.0) / 100 if n_pre < ordinais.size else None
+    acumulado, _ = aplicar_punitiva(historico, _plano_punitivo(ordinais, oc, tabelas, taxas))
+    return acumulado
+
+def _plano_punitivo(ordinais, oc, tabelas, taxas_selic):
+    """Multiplicadores e taxas dos juros punitivos por mês; None se não se aplicam."""
+    pratica, ipcae, periodos = tabelas.pratica, tabelas.ipcae, tabelas.periodos
+
+    n = ordinais.size
+    if n == 0 or ordinais[0] > ORD_DEZ_2021:
+        return None
+
+    g_ini, g_fim, ini_sem_correcao = janela_graca(oc)
+    na_graca = (ordinais >= g_ini) & (ordinais <= g_fim)
+    pre_2022 = ordinais < ORD_INICIO_SELIC
+    fora_pre = ~na_graca & pre_2022
+    n_pre = int(pre_2022.sum())
+
+    # Multiplicador do acumulado: IPCA-E na graça, Tabela Prática fora (até dez/2021)
+    mult = np.ones(n)
+    mult[na_graca] = ipcae.razoes_meses(ordinais[na_graca])
+    if ini_sem_correcao:
+        mult[ordinais == g_ini] = 1.0
+    mult[fora_pre] = pratica.razoes_meses(ordinais[fora_pre])
+    mult[0] = 1.0  # mês da Data Base: anterior == atual
+
+    # Taxa do mês: só é lançada no fim do período de vigência, vezes os meses
+    # fora da graça acumulados desde o último lançamento (ou desde a graça)
+    achou, fim_no_mes, taxa_mensal = periodos.meses(ordinais)
+    meta_fixa = ordinais <= ORD_FIM_META_FIXA
+    taxa_mensal = np.where(meta_fixa, 0.005, taxa_mensal)
+    lanca = np.where(meta_fixa, ordinais == ORD_FIM_META_FIXA, achou & fim_no_mes)
+    sem_periodo = ~meta_fixa & ~achou  # 0,5% no mês, sem zerar a contagem
+
+    zera = na_graca | (fora_pre & lanca)
+    idx = np.arange(n)
+    contagem = np.cumsum(fora_pre)
+    ultimo_zera = np.maximum.accumulate(np.where(zera, idx, -1))
+    anterior = np.concatenate(([-1], ultimo_zera[:-1]))
+    meses_fora = contagem - np.where(anterior >= 0, contagem[np.maximum(anterior, 0)], 0)
+
+    taxa = np.zeros(n)
+    taxa[lanca] = taxa_mensal[lanca] * meses_fora[lanca]
+    taxa[sem_periodo] = 0.005
+
+    plano = {"n_pre": n_pre, "fora_pre": fora_pre[:n_pre], "mult": mult[:n_pre], "taxa": taxa[:n_pre]}
+    if n_pre < n:
+        # Trecho SELIC: os mesmos arrays que avancar_punitiva montaria
+        graca_selic = na_graca[n_pre:]
+        mult_selic = np.ones(n - n_pre)
+        mult_selic[graca_selic] = ipcae.razoes_meses(ordinais[n_pre:][graca_selic])
+        plano.update(graca_selic=graca_selic, mult_selic=mult_selic, taxas_selic=taxas_selic)
+    return plano
+
+def aplicar_punitiva(historico, plano):
+    """Juros punitivos acumulados por mês a partir da série normal + base congelada do trecho SELIC (ou None)."""
+    if plano is None:
+        return None, None
+
+    n_pre = plano["n_pre"]
+    base = 0.0 + historico[:n_pre, 0] + historico[:n_pre, 2] + historico[:n_pre, 3]
+    incr = np.where(plano["fora_pre"], base * plano["taxa"], 0.0)
+
+    # Até dez/2021: corrigido e lançado; depois, SELIC simples sobre o acumulado congelado
+    acumulado = np.empty(historico.shape[0])
+    acumulado[:n_pre] = _recorrencia(0.0, plano["mult"], incr)
+    base_fixa = None
+    if n_pre < acumulado.size:
+        acumulado[n_pre:], base_fixa = punitiva_selic(
+            plano["graca_selic"], plano["mult_selic"], plano["taxas_selic"], acumulado[n_pre - 1], None
+        )
+        base_fixa = None if base_fixa is None else float(base_fixa)
+
+    return acumulado, base_fixa
+
+def avancar_punitiva(ordinais, acum_ini, base_fixa, oc, tabelas):
+    """
+    Juros punitivos nos meses >= jan/2022 a partir de um acumulado já existente.
+
+    Na graça o acumulado é corrigido pelo IPCA-E; fora dela soma base_fixa x SELIC.
+    Se base_fixa ainda for None, ela é o acumulado antes do primeiro mês fora da
+    graça. Retorna (acumulado por mês, base_fixa).
+    """
+    g_ini, g_fim, _ = janela_graca(oc)
+    na_graca = (ordinais >= g_ini) & (ordinais <= g_fim)
+    mult = np.ones(ordinais.size)
+    mult[na_graca] = tabelas.ipcae.razoes_meses(ordinais[na_graca])
+    taxas = tabelas.selic.valores_meses(ordinais, padrao=0.0) / 100
+
+    acumulado, base_fixa = punitiva_selic(na_graca, mult, taxas, acum_ini, base_fixa)
+    return acumulado, (None if base_fixa is None else float(base_fixa))
+
+def punitiva_selic(na_graca, mult, taxas, acum_ini, base_fixa):
+    """
+    Núcleo de avancar_punitiva para multiplicadores (IPCA-E na graça) e taxas
+    SELIC dados, com shape (meses,) ou (cenários, meses). base_fixa e o
+    resultado ganham a dimensão dos cenários quando houver.
+    """
+    n = na_graca.size
+    acumulado = np.empty(np.broadcast(mult, taxas).shape)
+    inicio = 0
+    if base_fixa is None:
+        fora = np.flatnonzero(~na_graca)
+        inicio = int(fora[0]) if fora.size else n
+        acumulado[..., :inicio] = _recorrencia(acum_ini, mult[..., :inicio], np.zeros(inicio))
+        if inicio == n:
+            return acumulado, None
+        base_fixa = acumulado[..., inicio - 1] if inicio else acum_ini
+        acum_ini = base_fixa
+
+    incr = np.where(na_graca[inicio:], 0.0, np.asarray(base_fixa)[..., None] * taxas[..., inicio:])
+    acumulado[..., inicio:] = _recorrencia(acum_ini, mult[..., inicio:], incr)
+    return acumulado, base_fixa
+
+# #######################################
+# Estado no último mês (para recálculo incremental)
+# #######################################
+def estado_final(valores, ord_base, ord_final, oc, tabelas=None, plano=None):
+    """
+    Calcula o ativo inteiro e devolve só o estado no mês final (dict), com o
+    necessário para avançar mês a mês depois (ver avancar_estado). `plano`
+    (de plano_calculo) evita remontar os arrays das tabelas.
+    """
+    if plano is None:
+        tabelas = registro_tabelas.atual() if tabelas is None else tabelas
+        plano = plano_calculo(ord_base, ord_final, oc, tabelas)
+    ordinais = plano["ordinais"]
+    if ordinais.size == 0:
+        return None
+
+    historico, estado_selic = aplicar_normal(valores, plano)
+    acumulado, base_fixa = aplicar_punitiva(historico, plano["punitivo"])
+    return {
+        "ord_mes": int(ordinais[-1]),
+        "normal": historico[-1].tolist(),
+        "selic_base": estado_selic[0].tolist() if estado_selic else None,
+        "selic_acum": estado_selic[1].tolist() if estado_selic else None,
+        "pun_acum": float(acumulado[-1]) if acumulado is not None else None,
+        "pun_base_fixa": base_fixa,
+    }
+
+def pode_avancar(estado, ord_final):
+    """Só dá para avançar estados já no trecho SELIC e anteriores ao mês pedido."""
+    return (
+        estado is not None
+        and estado["selic_base"] is not None
+        and estado["ord_mes"] <= ord_final
+    )
+
+def avancar_estado(estado, ord_final, oc, tabelas=None):
+    """Avança um estado (de estado_final) até ord_final, só com os meses novos."""
+    tabelas = registro_tabelas.atual() if tabelas is None else tabelas
+    ordinais = np.arange(estado["ord_mes"] + 1, ord_final + 1, dtype=np.int64)
+    if ordinais.size == 0:
+        return dict(estado)
+
+    base = np.asarray(estado["selic_base"])
+    valores, acum = avancar_selic_normal(ordinais, base, np.asarray(estado["selic_acum"]), tabelas)
+    novo = dict(estado, ord_mes=ord_final, normal=valores[-1].tolist(), selic_acum=acum[-1].tolist())
+    if estado["pun_acum"] is not None:
+        acumulado, base_fixa = avancar_punitiva(
+            ordinais, estado["pun_acum"], estado["pun_base_fixa"], oc, tabelas
+        )
+        novo["pun_acum"] = float(acumulado[-1])
+        novo["pun_base_fixa"] = base_fixa
+    return novo
+
+def totais_estado(estado):
+    """(valor normal, juros punitivos) no mês do estado."""
+    if estado is None:
+        return 0.0, 0.0
+    p_, j_, dp_, da_ = estado["normal"]
+    return p_ + j_ + dp_ + da_, (estado["pun_acum"] or 0.0)
@@ -0,0 +1,141 @@
+import os
+import atexit
+import multiprocessing as mp
+from collections import deque
+
+# #######################################
+# Pool de processos para o cálculo em lote
+# #######################################
+# Cálculo e ReportLab seguram o GIL: para usar todos os núcleos em lotes grandes
+# os ativos são distribuídos entre processos. Cada processo web (worker do
+# gunicorn, LMCALC_WEB_WORKERS) tem o seu pool "lote", e os núcleos são divididos
+# entre eles (no mínimo 2 por pool, para o lote não rodar em série): o total de
+# processos não cresce com cpu². Por isso o gunicorn.conf.py sobe poucos workers
+# web por padrão. O pool "jobs" tem orçamento próprio (jobs.py): um só no
+# cluster, com todos os núcleos e prioridade menor que a do lote.
+#
+# Os pools não nascem por fork do processo web: ele tem threads (gthread,
+# monitor das tabelas, jobs) e um fork com um lock preso trava o filho. Com
+# "forkserver" os workers saem de um servidor sem threads que já importou o
+# app (tabelas do cache .npy); sem ele, "spawn".
+WEB_WORKERS = max(1, int(os.environ.get("LMCALC_WEB_WORKERS", 1)))
+NUCLEOS = os.cpu_count() or 1
+NUCLEOS_POR_PROCESSO = min(NUCLEOS, max(2, NUCLEOS // WEB_WORKERS))
+WORKERS_PADRAO = int(os.environ.get("LMCALC_WORKERS", NUCLEOS_POR_PROCESSO))
+MIN_ATIVOS_PARALELO = int(os.environ.get("LMCALC_MIN_ATIVOS_PARALELO", 8))
+
+# Pools por nome: "lote" atende /calcular/lote; "jobs" roda os jobs em segundo plano
+_pools = {}
+# Prioridade (nice) dos processos de cada pool: os jobs cedem a CPU ao lote interativo
+PRIORIDADE_POOLS = {"jobs": int(os.environ.get("LMCALC_JOBS_NICE", 10))}
+
+def _contexto():
+    if "forkserver" in mp.get_all_start_methods():
+        contexto = mp.get_context("forkserver")
+        contexto.set_forkserver_preload(["app"])
+        return contexto
+    return mp.get_context("spawn")
+
+def _inicializa_worker(nice=0):
+    # Garante tabelas e motor carregados uma vez por worker, antes da 1ª tarefa
+    if nice and hasattr(os, "nice"):
+        os.nice(nice)
+    import app  # noqa: F401
+
+def _calcular_um(ativo, final_date, tabelas, modo, relatorio="completo"):
+    """
+    Calcula um ativo. modo "pdf" => ((nome_final, bytes), erro), com o PDF do
+    tipo `relatorio`; "historico" => resultado completo (com os históricos
+    mensais); senão só totais (via checkpoint).
+    """
+    from app import calcular_ativo, pdf_do_resultado
+
+    try:
+        resultado, erro = calcular_ativo(ativo, final_date, tabelas, historico=(modo != "totais"))
+    except Exception as e:
+        return None, f"Erro no cálculo: {e}"
+    if erro:
+        return None, erro
+    if modo == "pdf":
+        # Falha ao renderizar fica na linha do ativo: o ZIP em fluxo já começou
+        try:
+            pdf_bytes, nome_final = pdf_do_resultado(resultado, relatorio)
+        except Exception as e:
+            return None, f"Erro no PDF: {e}"
+        return (nome_final, pdf_bytes.getvalue()), None
+    return resultado, None
+
+def _tarefa(args):
+    from tabelas import registro_tabelas
+
+    ativo, final_date, versao, modo, relatorio = args
+    # Worker criado antes de uma recarga ainda tem a versão antiga: relê do disco
+    tabelas = registro_tabelas.garantir_versao(versao)
+    return _calcular_um(ativo, final_date, tabelas, modo, relatorio)
+
+def pool_calculo(workers=None, nome="lote"):
+    """Pool compartilhado entre requisições; recriado se o nº de workers mudar."""
+    workers = workers or WORKERS_PADRAO
+    pool, pool_workers = _pools.get(nome, (None, 0))
+    if pool is None or pool_workers != workers:
+        encerrar_pool(nome)
+        pool = _contexto().Pool(
+            processes=workers, initializer=_inicializa_worker, initargs=(PRIORIDADE_POOLS.get(nome, 0),)
+        )
+        _pools[nome] = (pool, workers)
+    return pool
+
+def encerrar_pool(nome=None, terminar=False):
+    """
+    Fecha o pool `nome` (ou todos, com nome=None) esperando as tarefas em
+    andamento; terminar=True descarta as tarefas ainda na fila (desligamento).
+    """
+    for n in ([nome] if nome is not None else list(_pools)):
+        pool, _ = _pools.pop(n, (None, 0))
+        if pool is not None:
+            if terminar:
+                pool.terminate()
+            else:
+                pool.close()
+            pool.join()
+
+atexit.register(encerrar_pool)
+
+def processar_ativos(ativos, final_date, tabelas, modo="totais", workers=None, nome_pool="lote", local=None,
+                     relatorio="completo", janela=None):
+    """
+    Gera os resultados do lote na mesma ordem dos ativos (determinístico).
+
+    Cada item é (resultado, erro) com resultado = totais do ativo ou, em modo
+    "pdf", (nome_final, bytes do PDF) no tipo `relatorio`. Todos os ativos usam a versão de
+    `tabelas`. Lotes pequenos ou workers=1 rodam no próprio processo; local=False
+    força o pool (jobs, para não disputar o GIL com as requisições).
+
+    Com `janela`, no máximo esse número de ativos fica em andamento/pronto sem
+    ter sido consumido: quem consome devagar (download em fluxo) segura o
+    envio de novas tarefas, em vez de acumular resultados em memória como o imap.
+    """
+    workers = workers or WORKERS_PADRAO
+    if local is None:
+        local = workers <= 1 or len(ativos) < MIN_ATIVOS_PARALELO
+    if local:
+        for ativo in ativos:
+            yield _calcular_um(ativo, final_date, tabelas, modo, relatorio)
+        return
+    tarefas = ((ativo, final_date, tabelas.versao, modo, relatorio) for ativo in ativos)
+    pool = pool_calculo(workers, nome_pool)
+    if janela:
+        yield from _em_janela(pool, tarefas, janela)
+        return
+    chunksize = max(1, min(64, len(ativos) // (workers * 4)))
+    yield from pool.imap(_tarefa, tarefas, chunksize=chunksize)
+
+def _em_janela(pool, tarefas, janela):
+    """Resultados em ordem, com no máximo `janela` tarefas enviadas e ainda não consumidas."""
+    pendentes = deque()
+    for tarefa in tarefas:
+        pendentes.append(pool.apply_async(_tarefa, (tarefa,)))
+        if len(pendentes) >= janela:
+            yield pendentes.popleft().get()
+    while pendentes:
+        yield pendentes.popleft().get()
@@ -0,0 +1,190 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from tabelas import ordinal_data
+from motor import (
+    ORD_DEZ_2021, janela_graca, serie_normal, serie_punitiva,
+    selic_normal, punitiva_selic,
+)
+from checkpoints import estado_ativo
+
+# #######################################
+# Projeções com cenários de SELIC / IPCA-E
+# #######################################
+# Valor do ativo em datas futuras, além do fim das tabelas. Até o último mês
+# coberto pelas tabelas o cálculo é o de sempre (via checkpoint); daí em diante
+# cada cenário fornece a SELIC (% a.m.) e a variação do IPCA-E (% a.m.) e todos
+# os cenários avançam juntos numa matriz (cenários x meses), a partir do mesmo
+# estado. Sem curva, o mês futuro usa a tabela se houver valor, senão SELIC 0 e
+# IPCA-E sem variação, exatamente como calcular_ativo.
+MAX_CENARIOS = int(os.environ.get("LMCALC_MAX_CENARIOS", 1000))
+MAX_DATAS = int(os.environ.get("LMCALC_MAX_DATAS_PROJECAO", 120))
+MAX_MESES_PROJECAO = int(os.environ.get("LMCALC_MAX_MESES_PROJECAO", 600))  # 50 anos além das tabelas
+
+INDICES_CENARIO = ("selic", "ipcae")
+
+def ultimo_mes_tabelas(tabelas):
+    """
+    Último mês com SELIC e IPCA-E nas tabelas (ordinal): o estado comum a todos
+    os cenários. Nunca antes de dez/2021, porque o cenário só cobre o trecho SELIC.
+    """
+    fins = [f for f in (tabelas.selic.ultimo_mes(), tabelas.ipcae.ultimo_mes()) if f is not None]
+    return max(min(fins, default=ORD_DEZ_2021), ORD_DEZ_2021)
+
+def data_pagamento(ordem_cronologica):
+    """Mês previsto de pagamento pela OC: o fim do período de graça (dez/OC)."""
+    return janela_graca(ordem_cronologica)[1]
+
+def _curva(spec, nome_indice):
+    """
+    Curva de um índice no cenário: número (taxa de todos os meses) ou dict
+    {"padrao": x, "AAAA-MM": taxa, ...}. Retorna ((padrao, {ordinal: taxa}), erro).
+    """
+    if spec is None:
+        return (None, {}), None
+    if isinstance(spec, (int, float)) and not isinstance(spec, bool):
+        return (float(spec), {}), None
+    if not isinstance(spec, dict):
+        return None, f"{nome_indice}: use um número ou um objeto {{\"padrao\": x, \"AAAA-MM\": taxa}}"
+
+    padrao, meses = None, {}
+    for chave, valor in spec.items():
+        try:
+            valor = float(valor)
+        except (TypeError, ValueError):
+            return None, f"{nome_indice}: taxa inválida em {chave}"
+        if chave == "padrao":
+            padrao = valor
+            continue
+        mes = pd.to_datetime(chave, format="%Y-%m", errors="coerce")
+        if pd.isna(mes):
+            return None, f"{nome_indice}: mês inválido {chave} (use AAAA-MM)"
+        meses[ordinal_data(mes)] = valor
+    return (padrao, meses), None
+
+def ler_cenarios(lista):
+    """
+    Valida os cenários do corpo da requisição. Sem cenários, um só ("tabelas")
+    sem curva. Retorna (cenarios, None) ou (None, mensagem de erro).
+    """
+    if lista is None:
+        lista = [{"nome": "tabelas"}]
+    if not isinstance(lista, list) or not lista:
+        return None, "cenarios deve ser uma lista de objetos"
+    if len(lista) > MAX_CENARIOS:
+        return None, f"Máximo de {MAX_CENARIOS} cenários por requisição"
+
+    cenarios = []
+    for i, spec in enumerate(lista, start=1):
+        if not isinstance(spec, dict):
+            return None, f"Cenário {i}: esperado um objeto"
+        cenario = {"nome": str(spec.get("nome") or f"cenario_{i}")}
+        for indice in INDICES_CENARIO:
+            curva, erro = _curva(spec.get(indice), indice)
+            if erro:
+                return None, f"Cenário {cenario['nome']}: {erro}"
+            cenario[indice] = curva
+        cenarios.append(cenario)
+    return cenarios, None
+
+def _matriz(cenarios, indice, ordinais, tabela, neutro, taxa):
+    """
+    (cenários x meses) com a taxa de cada mês: valor explícito do cenário, senão
+    o da tabela (NaN onde falta), senão o padrão do cenário, senão `neutro`.
+    `taxa` converte o % informado no cenário para a unidade do motor.
+    """
+    padroes = np.array([neutro if c[indice][0] is None else taxa(c[indice][0]) for c in cenarios])
+    matriz = np.where(np.isnan(tabela)[None, :], padroes[:, None], tabela[None, :])
+    for k, cenario in enumerate(cenarios):
+        for ordinal, valor in cenario[indice][1].items():
+            i = ordinal - ordinais[0]
+            if 0 <= i < ordinais.size:
+                matriz[k, i] = taxa(valor)
+    return matriz
+
+def curvas_cenarios(cenarios, ordinais, tabelas):
+    """Taxas SELIC (fração) e razões do IPCA-E (cenários x meses) para os meses futuros."""
+    selic = _matriz(
+        cenarios, "selic", ordinais, tabelas.selic.valores_meses(ordinais) / 100, 0.0, lambda v: v / 100
+    )
+    # Razão da tabela só onde há o mês e o anterior; no resto, a variação do cenário
+    ipcae = tabelas.ipcae
+    tem_razao = ~np.isnan(ipcae.valores_meses(ordinais)) & ~np.isnan(ipcae.valores_meses(ordinais - 1))
+    razoes = _matriz(
+        cenarios, "ipcae", ordinais, np.where(tem_razao, ipcae.razoes_meses(ordinais), np.nan),
+        1.0, lambda v: 1.0 + v / 100,
+    )
+    return selic, razoes
+
+def _soma(valores):
+    """Principal + Juros + descontos, na mesma ordem de soma do resultado do ativo."""
+    return valores[..., 0] + valores[..., 1] + valores[..., 2] + valores[..., 3]
+
+def projetar(ordem_cronologica, ord_base, valores, ords_alvo, cenarios, tabelas):
+    """
+    Valor normal e juros punitivos do ativo em cada mês alvo, por cenário.
+
+    Retorna (normal, punitivo), arrays (cenários x alvos). Alvos até o fim das
+    tabelas têm o mesmo valor em todos os cenários; os seguintes vêm de uma
+    única passada vetorizada sobre todos os cenários.
+    """
+    ords_alvo = np.asarray(ords_alvo, dtype=np.int64)
+    normal = np.zeros((len(cenarios), ords_alvo.size))
+    punitivo = np.zeros_like(normal)
+    corte = ultimo_mes_tabelas(tabelas)
+
+    # 1) Alvos cobertos pelas tabelas: cálculo comum a todos os cenários
+    passados = (ords_alvo >= ord_base) & (ords_alvo <= corte)
+    if passados.any():
+        ordinais, serie = serie_normal(valores, ord_base, int(ords_alvo[passados].max()), ordem_cronologica, tabelas)
+        acumulado = serie_punitiva(ordinais, serie, ordem_cronologica, tabelas)
+        i = ords_alvo[passados] - ord_base
+        normal[:, passados] = _soma(serie)[i]
+        if acumulado is not None:
+            punitivo[:, passados] = acumulado[i]
+
+    # 2) Alvos além das tabelas: todos os cenários a partir do mesmo estado
+    futuros = (ords_alvo >= ord_base) & (ords_alvo > corte)
+    if not futuros.any():
+        return normal, punitivo
+
+    if ord_base > corte:
+        # Data Base já no trecho SELIC: o próprio mês da Data Base recebe a taxa
+        inicio, base, selic_acum, estado = ord_base, np.asarray(valores, dtype=float), np.zeros(len(valores)), None
+    else:
+        estado, _ = estado_ativo(ordem_cronologica, ord_base, valores, corte, tabelas)
+        inicio, base, selic_acum = corte + 1, np.asarray(estado["selic_base"]), np.asarray(estado["selic_acum"])
+
+    ordinais = np.arange(inicio, int(ords_alvo[futuros].max()) + 1, dtype=np.int64)
+    selic, razoes_ipcae = curvas_cenarios(cenarios, ordinais, tabelas)
+    i = ords_alvo[futuros] - inicio
+
+    valores_mes, _ = selic_normal(base, selic_acum, selic)
+    normal[:, futuros] = _soma(valores_mes)[:, i]
+
+    if estado is not None and estado["pun_acum"] is not None:
+        g_ini, g_fim, _ = janela_graca(ordem_cronologica)
+        na_graca = (ordinais >= g_ini) & (ordinais <= g_fim)
+        mult = np.where(na_graca, razoes_ipcae, 1.0)
+        acumulado, _ = punitiva_selic(na_graca, mult, selic, estado["pun_acum"], estado["pun_base_fixa"])
+        punitivo[:, futuros] = acumulado[:, i]
+    return normal, punitivo
+
+def validar_alvos(ords_alvo, tabelas, ord_base=None):
+    """
+    Erro (texto) se os alvos passarem dos limites de projeção ou, dado o mês da
+    Data Base do ativo, forem anteriores a ele; None se ok.
+    """
+    if len(ords_alvo) > MAX_DATAS:
+        return f"Máximo de {MAX_DATAS} datas por requisição"
+    if ord_base is not None and ords_alvo and min(ords_alvo) < ord_base:
+        return f"Data anterior à Data Base ({ord_base // 12}-{ord_base % 12 + 1:02d})"
+    limite = ultimo_mes_tabelas(tabelas) + MAX_MESES_PROJECAO
+    if ords_alvo and max(ords_alvo) > limite:
+        return f"Data além do limite de projeção ({limite // 12}-{limite % 12 + 1:02d})"
+    return None
+
+def mes_do_ordinal(ordinal):
+    return pd.Timestamp(year=ordinal // 12, month=ordinal % 12 + 1, day=1)
@@ -0,0 +1,408 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger("lmcalc")
+
+# #######################################
+# Caminhos das tabelas
+# #######################################
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+arquivo_tabela_pratica = os.path.join(BASE_DIR, "Tabela_Pratica_TJSP.xlsx")
+arquivo_tabela_ipcae   = os.path.join(BASE_DIR, "Tabela_IPCA-E.xlsx")
+arquivo_tabela_selic   = os.path.join(BASE_DIR, "Tabela_Selic.xlsx")
+arquivo_selic_antes    = os.path.join(BASE_DIR, "Selic_antes_2022.xlsx")
+
+# #######################################
+# Índices por ordinal do mês
+# #######################################
+def ordinal_mes(ano, mes):
+    """Converte (ano, mês) -> ordinal do mês (ano*12 + mês - 1)."""
+    return int(ano) * 12 + int(mes) - 1
+
+def ordinal_data(ts):
+    """Ordinal do mês de um Timestamp/datetime."""
+    return ts.year * 12 + ts.month - 1
+
+class IndiceMensal:
+    """
+    Índice mensal (Tabela Prática, IPCA-E ou SELIC) indexado pelo ordinal do mês.
+
+    Montado uma vez na carga da planilha: as consultas são O(1) e não dependem
+    do tamanho da tabela. Mês ausente => sem valor (razão 1.0, como no loop original).
+    """
+
+    def __init__(self, inicio, valores, razao_mensal=None):
+        self.inicio = int(inicio)
+        self.fim = self.inicio + len(valores) - 1
+        self.valores = valores
+        self.presente = ~np.isnan(self.valores)
+
+        # Razão mês a mês (1.0 quando falta o mês atual ou o anterior)
+        if razao_mensal is None:
+            razao_mensal = np.ones_like(self.valores)
+            ok = self.presente[1:] & self.presente[:-1]
+            razao_mensal[1:][ok] = self.valores[1:][ok] / self.valores[:-1][ok]
+        self.razao_mensal = razao_mensal
+
+    @classmethod
+    def de_tabela(cls, tabela, coluna="Índice"):
+        """Monta o índice a partir da planilha (colunas Ano, Mês e Índice)."""
+        ordinais = (tabela["Ano"].astype(int) * 12 + tabela["Mês"].astype(int) - 1).to_numpy()
+        valores = tabela[coluna].to_numpy(dtype=float)
+        if ordinais.size == 0:
+            ordinais = np.array([0])
+            valores = np.array([np.nan])
+
+        inicio = int(ordinais.min())
+        densos = np.full(int(ordinais.max()) - inicio + 1, np.nan)
+        # Em caso de mês repetido vale a primeira linha (igual ao filtro + values[0])
+        densos[ordinais[::-1] - inicio] = valores[::-1]
+        return cls(inicio, densos)
+
+    def como_array(self):
+        """Linhas: ordinal, índice, razão mensal (formato do cache .npy)."""
+        ordinais = np.arange(self.inicio, self.fim + 1, dtype=float)
+        return np.vstack([ordinais, self.valores, self.razao_mensal])
+
+    @classmethod
+    def de_array(cls, arr):
+        return cls(int(arr[0, 0]), arr[1], arr[2])
+
+    def valor(self, ordinal, padrao=None):
+        """Valor do índice no mês, ou `padrao` se o mês não estiver na tabela."""
+        i = ordinal - self.inicio
+        if 0 <= i < self.valores.size and self.presente[i]:
+            return self.valores[i]
+        return padrao
+
+    def razao(self, ordinal_atual, ordinal_anterior):
+        """Índice atual / índice anterior; 1.0 se faltar algum dos dois meses."""
+        fc = self.valor(ordinal_atual)
+        fp = self.valor(ordinal_anterior)
+        if fc is None or fp is None:
+            return 1.0
+        return fc / fp
+
+    def valores_meses(self, ordinais, padrao=np.nan):
+        """Vetor com o valor do índice para cada ordinal (padrao quando ausente)."""
+        ordinais = np.asarray(ordinais, dtype=np.int64)
+        out = np.full(ordinais.shape, padrao, dtype=float)
+        i = ordinais - self.inicio
+        ok = (i >= 0) & (i < self.valores.size)
+        out[ok] = self.valores[i[ok]]
+        out[np.isnan(out)] = padrao
+        return out
+
+    def razoes_meses(self, ordinais):
+        """Razão mês a mês (mês t contra t-1) para cada ordinal; 1.0 fora da tabela."""
+        ordinais = np.asarray(ordinais, dtype=np.int64)
+        out = np.ones(ordinais.shape, dtype=float)
+        i = ordinais - self.inicio
+        ok = (i >= 0) & (i < self.valores.size)
+        out[ok] = self.razao_mensal[i[ok]]
+        return out
+
+    def ultimo_mes(self):
+        """Ordinal do último mês com valor na tabela (None se vazia)."""
+        idx = np.flatnonzero(self.presente)
+        return self.inicio + int(idx[-1]) if idx.size else None
+
+class PeriodosMetaSelic:
+    """
+    Períodos de vigência da meta SELIC (Selic_antes_2022) mapeados por mês.
+
+    Para cada mês (dia 1) guarda se algum período o cobre, se esse período termina
+    no próprio mês e a taxa mensal dos juros punitivos: 0,70 x meta/12 quando a
+    meta é <= 8,5% a.a., senão 0,5%. Vale a primeira linha que cobre o dia 1.
+    """
+
+    def __init__(self, inicio, achou, fim_no_mes, taxa_mensal):
+        self.inicio = int(inicio)
+        self.fim = self.inicio + len(achou) - 1
+        self.achou = achou
+        self.fim_no_mes = fim_no_mes
+        self.taxa_mensal = taxa_mensal
+
+    @classmethod
+    def de_tabela(cls, tabela):
+        """Monta o mapa mensal a partir da planilha Selic_antes_2022."""
+        ini = pd.to_datetime(tabela["PERÍODO DE VIGÊNCIA INICIAL"]).to_numpy(dtype="datetime64[D]")
+        fim = pd.to_datetime(tabela["PERÍODO DE VIGÊNCIA FINAL"]).to_numpy(dtype="datetime64[D]")
+        meta = tabela["META SELIC (A.A) %"].to_numpy(dtype=float)
+
+        validos = ~np.isnat(ini) & ~np.isnat(fim)
+        if not validos.any():
+            return cls(0, np.zeros(0, dtype=bool), np.zeros(0, dtype=bool), np.zeros(0))
+        inicio = ordinal_data(pd.Timestamp(ini[validos].min()))
+        ordinais = np.arange(inicio, ordinal_data(pd.Timestamp(fim[validos].max())) + 1)
+        dias_1 = np.array(
+            [f"{o // 12:04d}-{o % 12 + 1:02d}-01" for o in ordinais], dtype="datetime64[D]"
+        )
+
+        # Matriz meses x períodos; a comparação com NaT é sempre falsa
+        cobre = (ini[None, :] <= dias_1[:, None]) & (fim[None, :] >= dias_1[:, None])
+        achou = cobre.any(axis=1)
+        linha = cobre.argmax(axis=1)
+
+        fim_linha = fim[linha]
+        mes_fim = np.where(
+            np.isnat(fim_linha), -1,
+            fim_linha.astype("datetime64[M]").astype(np.int64) + ordinal_mes(1970, 1)
+        )
+        fim_no_mes = achou & (mes_fim == ordinais)
+
+        meta_linha = meta[linha]
+        taxa_mensal = np.where(meta_linha <= 8.5, 0.70 * ((meta_linha / 12) / 100), 0.005)
+        return cls(inicio, achou, fim_no_mes, taxa_mensal)
+
+    def como_array(self):
+        """Linhas: ordinal, achou, fim_no_mes, taxa mensal (formato do cache .npy)."""
+        ordinais = np.arange(self.inicio, self.fim + 1, dtype=float)
+        return np.vstack([ordinais, self.achou, self.fim_no_mes, self.taxa_mensal]).astype(float)
+
+    @classmethod
+    def de_array(cls, arr):
+        inicio = int(arr[0, 0]) if arr.shape[1] else 0
+        return cls(inicio, arr[1] != 0, arr[2] != 0, arr[3])
+
+    def meses(self, ordinais):
+        """Retorna (achou, fim_no_mes, taxa_mensal) para cada ordinal."""
+        ordinais = np.asarray(ordinais, dtype=np.int64)
+        achou = np.zeros(ordinais.shape, dtype=bool)
+        fim_no_mes = np.zeros(ordinais.shape, dtype=bool)
+        taxa = np.full(ordinais.shape, 0.005)
+        i = ordinais - self.inicio
+        ok = (i >= 0) & (i < self.achou.size)
+        achou[ok] = self.achou[i[ok]]
+        fim_no_mes[ok] = self.fim_no_mes[i[ok]]
+        taxa[ok] = self.taxa_mensal[i[ok]]
+        return achou, fim_no_mes, taxa
+
+# #######################################
+# Cache binário das planilhas
+# #######################################
+# Ler os .xlsx com openpyxl é lento; na primeira carga cada tabela vira um .npy
+# (já no formato denso por mês) identificado pelo hash do conteúdo da planilha.
+# Nas próximas cargas, e em cada worker, o .npy é só mapeado em memória.
+DIR_CACHE_TABELAS = os.environ.get("LMCALC_CACHE_TABELAS", os.path.join(BASE_DIR, ".cache_tabelas"))
+
+# Versão do formato do .npy e da derivação das tabelas (razões, taxas da meta
+# SELIC, ...). Entra no nome do cache e na versão das tabelas: quem mudar o que
+# é gravado ou como é derivado da planilha sobe este número, e os .npy, resultados,
+# PDFs e checkpoints da derivação anterior deixam de ser reaproveitados.
+FORMATO_CACHE_TABELAS = 2
+
+def hash_arquivo(caminho):
+    with open(caminho, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def ler_tabela_indice(caminho):
+    tbl = pd.read_excel(caminho)
+    tbl["Ano"] = tbl["Ano"].astype(int)
+    tbl["Mês"] = tbl["Mês"].astype(int)
+    tbl.sort_values(by=["Ano", "Mês"], inplace=True, ignore_index=True)
+    return IndiceMensal.de_tabela(tbl)
+
+def ler_tabela_selic_antes(caminho):
+    return PeriodosMetaSelic.de_tabela(pd.read_excel(caminho))
+
+def carregar_com_cache(caminho, ler, classe, hash_conteudo=None):
+    """
+    Carrega a tabela do cache .npy (mmap) se ele corresponder ao conteúdo atual
+    da planilha; senão lê a planilha e grava o cache. Retorna (tabela, do_cache).
+    """
+    hash_conteudo = hash_conteudo or hash_arquivo(caminho)
+    nome = os.path.splitext(os.path.basename(caminho))[0]
+    caminho_cache = os.path.join(
+        DIR_CACHE_TABELAS, f"{nome}-v{FORMATO_CACHE_TABELAS}-{hash_conteudo[:16]}.npy"
+    )
+
+    if os.path.exists(caminho_cache):
+        try:
+            return classe.de_array(np.load(caminho_cache, mmap_mode="r")), True
+        except (OSError, ValueError, IndexError):
+            pass  # cache corrompido => recria
+
+    tabela = ler(caminho)
+    try:
+        os.makedirs(DIR_CACHE_TABELAS, exist_ok=True)
+        tmp = f"{caminho_cache}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, tabela.como_array())
+        os.replace(tmp, caminho_cache)
+        # Remove caches de versões anteriores da mesma planilha (ou do formato)
+        for antigo in os.listdir(DIR_CACHE_TABELAS):
+            if antigo.startswith(f"{nome}-") and antigo.endswith(".npy") and \
+                    os.path.join(DIR_CACHE_TABELAS, antigo) != caminho_cache:
+                os.remove(os.path.join(DIR_CACHE_TABELAS, antigo))
+    except OSError:
+        pass  # sem permissão de escrita: segue sem cache
+    return tabela, False
+
+def versao_de_hashes(hashes):
+    """
+    Identificador curto do conteúdo das planilhas e do formato derivado (muda quando
+    alguma planilha é atualizada ou FORMATO_CACHE_TABELAS sobe).
+    """
+    h = hashlib.sha1(f"formato-{FORMATO_CACHE_TABELAS}".encode())
+    for hash_conteudo in hashes:
+        h.update(bytes.fromhex(hash_conteudo))
+    return h.hexdigest()[:12]
+
+# #######################################
+# Registro de tabelas (versionado, com recarga a quente)
+# #######################################
+class ConjuntoTabelas:
+    """Conjunto imutável das tabelas carregadas, identificado por `versao`."""
+
+    def __init__(self, pratica, ipcae, selic, periodos, versao, carregado_em, tempo_carga, do_cache):
+        self.pratica = pratica
+        self.ipcae = ipcae
+        self.selic = selic
+        self.periodos = periodos
+        self.versao = versao
+        self.carregado_em = carregado_em
+        self.tempo_carga = tempo_carga
+        self.do_cache = do_cache
+
+def log_carga(conjunto, destino=log):
+    """Registra em INFO, no logger `destino`, o tempo de carga, a origem e a versão das tabelas."""
+    destino.info(
+        "Tabelas carregadas em %.1f ms (%s, versão %s)",
+        conjunto.tempo_carga * 1000, "cache .npy" if conjunto.do_cache else "planilhas .xlsx", conjunto.versao,
+        extra={"dados": {"evento": "tabelas", "versao_tabelas": conjunto.versao,
+                         "tempo_carga_ms": round(conjunto.tempo_carga * 1000, 2), "do_cache": conjunto.do_cache}},
+    )
+
+class RegistroTabelas:
+    """
+    Mantém o ConjuntoTabelas em uso e o troca atomicamente quando as planilhas mudam.
+
+    Cada requisição pega `atual()` uma vez e calcula inteira com esse conjunto,
+    então uma recarga (feita em outra thread) nunca mistura versões nem bloqueia
+    requisições em andamento.
+    """
+
+    LEITORES = {
+        "pratica":     (ler_tabela_indice, IndiceMensal),
+        "ipcae":       (ler_tabela_indice, IndiceMensal),
+        "selic":       (ler_tabela_indice, IndiceMensal),
+        "selic_antes": (ler_tabela_selic_antes, PeriodosMetaSelic),
+    }
+
+    def __init__(self, arquivos):
+        self.arquivos = arquivos
+        self._atual = None
+        self._assinatura = None
+        self._lock = threading.Lock()
+        self._monitor = None
+
+    def _assinatura_arquivos(self):
+        out = []
+        for caminho in self.arquivos.values():
+            st = os.stat(caminho)
+            out.append((st.st_mtime_ns, st.st_size))
+        return tuple(out)
+
+    def atual(self):
+        if self._atual is None:
+            self.recarregar()
+        return self._atual
+
+    def recarregar(self):
+        """Lê as planilhas (ou o cache .npy) e publica o novo conjunto. Retorna o conjunto."""
+        with self._lock:
+            t0 = time.perf_counter()
+            assinatura = self._assinatura_arquivos()
+            hashes = {nome: hash_arquivo(c) for nome, c in self.arquivos.items()}
+            versao = versao_de_hashes(hashes.values())
+            if self._atual is not None and self._atual.versao == versao:
+                self._assinatura = assinatura
+                return self._atual
+
+            carregadas = {}
+            do_cache = True
+            for nome, caminho in self.arquivos.items():
+                ler, classe = self.LEITORES[nome]
+                carregadas[nome], cache_ok = carregar_com_cache(caminho, ler, classe, hashes[nome])
+                do_cache = do_cache and cache_ok
+
+            conjunto = ConjuntoTabelas(
+                carregadas["pratica"], carregadas["ipcae"], carregadas["selic"], carregadas["selic_antes"],
+                versao=versao,
+                carregado_em=time.time(),
+                tempo_carga=time.perf_counter() - t0,
+                do_cache=do_cache,
+            )
+            self._atual = conjunto  # troca atômica da referência
+            self._assinatura = assinatura
+            log_carga(conjunto)
+            return conjunto
+
+    def verificar_atualizacao(self):
+        """Recarrega se alguma planilha mudou no disco (mtime/tamanho). Retorna o conjunto atual."""
+        if self._atual is None or self._assinatura_arquivos() != self._assinatura:
+            return self.recarregar()
+        return self._atual
+
+    def garantir_versao(self, versao):
+        """Usado nos workers: se o processo principal já trocou de versão, recarrega do disco."""
+        conjunto = self.atual()
+        if conjunto.versao != versao:
+            conjunto = self.verificar_atualizacao()
+        return conjunto
+
+    def instalar_planilha(self, nome, conteudo):
+        """
+        Substitui a planilha `nome` pelo conteúdo enviado e recarrega.
+
+        O arquivo é validado (lido e convertido) antes de trocar o original;
+        ValueError se o nome não existir ou a planilha for inválida.
+        """
+        if nome not in self.arquivos:
+            raise ValueError(f"Tabela desconhecida: {nome}. Use {', '.join(self.arquivos)}")
+        destino = self.arquivos[nome]
+        tmp = f"{destino}.{os.getpid()}.upload.xlsx"
+        with open(tmp, "wb") as f:
+            f.write(conteudo)
+        try:
+            ler, _ = self.LEITORES[nome]
+            ler(tmp)
+        except Exception as e:
+            os.remove(tmp)
+            raise ValueError(f"Planilha inválida para {nome}: {e}")
+        os.replace(tmp, destino)
+        return self.recarregar()
+
+    def iniciar_monitoramento(self, intervalo):
+        """Thread daemon que verifica as planilhas a cada `intervalo` segundos."""
+        if intervalo <= 0 or (self._monitor is not None and self._monitor.is_alive()):
+            return
+
+        def loop():
+            while True:
+                time.sleep(intervalo)
+                try:
+                    self.verificar_atualizacao()
+                except Exception as e:
+                    log.exception("Falha ao recarregar tabelas: %s", e)
+
+        self._monitor = threading.Thread(target=loop, name="monitor-tabelas", daemon=True)
+        self._monitor.start()
+
+# #######################################
+# Ler as planilhas
+# #######################################
+registro_tabelas = RegistroTabelas({
+    "pratica":     arquivo_tabela_pratica,
+    "ipcae":       arquivo_tabela_ipcae,
+    "selic":       arquivo_tabela_selic,
+    "selic_antes": arquivo_selic_antes,
+})
+registro_tabelas.recarregar()
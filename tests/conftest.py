@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+# Testes não gravam checkpoints/PDFs/jobs no diretório do projeto nem sobem a thread de recarga
+os.environ.setdefault("LMCALC_CHECKPOINTS", "")
+os.environ.setdefault("LMCALC_CACHE_PDF", "")
+os.environ.setdefault("LMCALC_JOBS", os.path.join(tempfile.mkdtemp(prefix="lmcalc_testes_"), "jobs.sqlite"))
+os.environ.setdefault("LMCALC_RECARGA_TABELAS_S", "0")
@@ -0,0 +1,60 @@
+"""
+Regrava tests/golden/casos.json com o motor atual.
+
+Uso: python tests/gerar_golden.py
+
+Só deve ser rodado quando uma mudança de resultado for intencional (regra de
+cálculo ou tabelas novas); a diferença no JSON mostra o que mudou, centavo a centavo.
+"""
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LMCALC_CHECKPOINTS", "")
+os.environ.setdefault("LMCALC_RECARGA_TABELAS_S", "0")
+
+import pandas as pd
+
+from app import calcular_ativo
+from historico import rotulo_iso
+
+CAMINHO_GOLDEN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden", "casos.json")
+
+def historico_centavos(resultado):
+    """[[AAAA-MM, principal, juros, desc. prev, desc. assist, punitivo], ...] em centavos."""
+    historico = resultado["historico"]
+    return [
+        [rotulo_iso(o)[:7], round(p_, 2), round(j_, 2), round(dp_, 2), round(da_, 2), round(pun, 2)]
+        for o, (p_, j_, dp_, da_), pun in zip(
+            historico.ordinais.tolist(), historico.valores.tolist(), historico.punitivo_ou_zeros().tolist()
+        )
+    ]
+
+def caso_golden(caso):
+    """Recalcula um caso (entrada + mês final) e devolve o registro golden."""
+    resultado, erro = calcular_ativo(caso["ativo"], pd.Timestamp(caso["final_date"]))
+    if erro:
+        raise ValueError(f"{caso['nome']}: {erro}")
+    return {
+        "nome": caso["nome"],
+        "final_date": caso["final_date"],
+        "ativo": caso["ativo"],
+        "valor_normal": round(resultado["valor_normal_final"], 2),
+        "valor_punitivo": round(resultado["valor_punitivo_final"], 2),
+        "valor_total": round(resultado["valor_total_final"], 2),
+        "historico": historico_centavos(resultado),
+    }
+
+def gravar_golden(casos, caminho=CAMINHO_GOLDEN):
+    # Um caso por linha: diffs legíveis quando um valor muda
+    with open(caminho, "w", encoding="utf-8") as f:
+        f.write("[\n")
+        f.write(",\n".join(json.dumps(c, ensure_ascii=False) for c in casos))
+        f.write("\n]\n")
+
+if __name__ == "__main__":
+    with open(CAMINHO_GOLDEN, encoding="utf-8") as f:
+        casos = json.load(f)
+    gravar_golden([caso_golden(c) for c in casos])
+    print(f"{len(casos)} casos regravados em {CAMINHO_GOLDEN}")
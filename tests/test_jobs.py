@@ -0,0 +1,78 @@
+"""
+Jobs em segundo plano: fila no SQLite, um job por vez no cluster e resultado
+parcial disponível enquanto o job executa.
+"""
+import threading
+import time
+
+import pandas as pd
+
+import jobs
+from app import app
+from jobs import ArmazemJobs, executor_jobs
+from paralelo import _calcular_um
+from tests.test_golden import CASOS
+
+def test_um_job_por_vez(tmp_path):
+    # Dois processos web (duas conexões) consomem a mesma fila: o segundo job
+    # só é reservado depois que o primeiro termina
+    caminho = str(tmp_path / "jobs.sqlite")
+    web_1, web_2 = ArmazemJobs(caminho), ArmazemJobs(caminho)
+    final_date = pd.Timestamp("2024-12-01")
+    primeiro = web_1.criar([{"Nome Completo": "A"}], "totais", final_date)
+    segundo = web_1.criar([{"Nome Completo": "B"}], "totais", final_date)
+
+    assert web_1.reservar_proximo()["id"] == primeiro
+    assert web_2.reservar_proximo() is None
+    web_1.finalizar(primeiro, "concluido")
+    assert web_2.reservar_proximo()["id"] == segundo
+
+def _esperar(cliente, job_id, condicao, limite_s=30):
+    fim = time.monotonic() + limite_s
+    while time.monotonic() < fim:
+        progresso = cliente.get(f"/jobs/{job_id}").get_json()
+        if condicao(progresso):
+            return progresso
+        time.sleep(0.02)
+    raise AssertionError(f"job não chegou ao estado esperado: {progresso}")
+
+def test_job_resultado_parcial(monkeypatch):
+    # Cálculo no próprio processo, parando depois do 2º ativo até o teste liberar
+    liberar = threading.Event()
+
+    def processar_em_partes(ativos, final_date, tabelas, modo="totais", **_):
+        for i, ativo in enumerate(ativos):
+            if i == 2:
+                liberar.wait(30)
+            yield _calcular_um(ativo, final_date, tabelas, modo)
+
+    monkeypatch.setattr(jobs, "processar_ativos", processar_em_partes)
+    monkeypatch.setattr(jobs, "GRAVAR_A_CADA_ITENS", 1)
+    ativos = [c["ativo"] for c in CASOS[:5]] + [{"Nome Completo": "Sem Data Base", "Ordem Cronológica": "0001/2024"}]
+    cliente = app.test_client()
+    try:
+        resposta = cliente.post("/jobs", json=ativos)
+        assert resposta.status_code == 202
+        job_id = resposta.get_json()["job_id"]
+        assert resposta.headers["Location"] == f"/jobs/{job_id}"
+
+        progresso = _esperar(cliente, job_id, lambda p: p["feitos"] == 2)
+        assert progresso["status"] == "executando"
+        assert progresso["pendentes"] == len(ativos) - 2
+        parcial = cliente.get(f"/jobs/{job_id}/resultado")
+        assert parcial.headers["X-Job-Status"] == "executando"
+        assert [l["linha"] for l in parcial.get_json()] == [1, 2]
+
+        liberar.set()
+        progresso = _esperar(cliente, job_id, lambda p: p["status"] == "concluido")
+        assert (progresso["feitos"], progresso["falhas"], progresso["pendentes"]) == (len(ativos) - 1, 1, 0)
+        final = cliente.get(f"/jobs/{job_id}/resultado")
+        assert final.headers["X-Job-Status"] == "concluido"
+        linhas = final.get_json()
+        assert [l["linha"] for l in linhas] == list(range(1, len(ativos) + 1))
+        assert linhas[-1]["erro"] == "Data Base ausente ou inválida"
+        csv = cliente.get(f"/jobs/{job_id}/resultado?format=csv")
+        assert csv.data.decode("utf-8-sig").count("\n") == len(ativos) + 1
+    finally:
+        liberar.set()
+        executor_jobs.parar()
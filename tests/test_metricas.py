@@ -0,0 +1,45 @@
+"""
+Métricas e log: etapa de envio medida no fechamento da resposta, soma entre
+processos web e mensagem de carga das tabelas no stderr.
+"""
+import json
+import os
+
+from app import app
+from metricas import Contador, Histograma, Registro, configurar_log, latencia_etapa, log_inicio
+from tabelas import log_carga, registro_tabelas
+
+def test_envio_medido_ao_fechar_a_resposta():
+    antes = latencia_etapa.valores().get(("envio",), [0])[-1]
+    resposta = app.test_client().get("/")
+    assert resposta.status_code == 200
+    resposta.close()
+    assert latencia_etapa.valores()[("envio",)][-1] == antes + 1
+
+def test_metricas_somadas_entre_processos(tmp_path):
+    registro = Registro()
+    contador = registro.registrar(Contador("teste_total", "Teste", ("rota",)))
+    histograma = registro.registrar(Histograma("teste_segundos", "Teste", buckets=(0.1, 1.0)))
+    contador.inc("/calcular", valor=2)
+    histograma.observar(0.05)
+
+    # Estado gravado por outro worker web
+    (tmp_path / "1.json").write_text(json.dumps({
+        "teste_total": [[["/calcular"], 3], [["/metrics"], 1]],
+        "teste_segundos": [[[], [0, 1, 0.5, 1]]],
+    }))
+    registro.compartilhar(str(tmp_path), intervalo=3600)
+    texto = registro.texto()
+    assert 'teste_total{rota="/calcular"} 5' in texto
+    assert 'teste_total{rota="/metrics"} 1' in texto
+    assert 'teste_segundos_bucket{le="1"} 2' in texto
+    assert "teste_segundos_count 2" in texto
+    assert os.path.exists(tmp_path / f"{os.getpid()}.json")
+
+def test_carga_das_tabelas_no_stderr(capsys):
+    # Sem LMCALC_LOG o logger "lmcalc" só mostra WARNING+; a carga sai uma vez, em INFO
+    configurar_log(None)
+    log_carga(registro_tabelas.atual(), log_inicio)
+    erro = capsys.readouterr().err
+    assert erro.count("Tabelas carregadas") == 1
+    assert " INFO " in erro
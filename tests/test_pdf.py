@@ -0,0 +1,138 @@
+"""
+Relatórios resumido/anual, cache de PDFs em disco (com ETag) e ZIP do lote em fluxo.
+"""
+import io
+import os
+import json
+import zipfile
+
+import numpy as np
+import pytest
+
+import app as modulo_app
+import paralelo
+from cache import CacheArquivos
+from historico import Historico, rotulo_br
+from tabelas import ordinal_mes
+from tests.test_golden import CASOS
+
+ATIVO = next(c for c in CASOS if c["nome"].startswith("Borda 2011-07-01"))["ativo"]
+
+@pytest.fixture
+def cliente(tmp_path, monkeypatch):
+    monkeypatch.setattr(modulo_app, "cache_pdf", CacheArquivos(str(tmp_path / "pdf"), 10 * 1024 * 1024, ".pdf"))
+    return modulo_app.app.test_client()
+
+def test_relatorios_menores(cliente):
+    tamanhos = {}
+    for relatorio in modulo_app.RELATORIOS_PDF:
+        resposta = cliente.post(f"/calcular?relatorio={relatorio}", json=ATIVO)
+        assert resposta.status_code == 200
+        assert resposta.data.startswith(b"%PDF")
+        tamanhos[relatorio] = len(resposta.data)
+    assert tamanhos["resumo"] < tamanhos["anual"] < tamanhos["completo"]
+    assert cliente.post("/calcular?relatorio=mensal", json=ATIVO).status_code == 400
+
+def test_historico_anual():
+    ordinais = np.array([ordinal_mes(2020, 11), ordinal_mes(2020, 12), ordinal_mes(2021, 1), ordinal_mes(2021, 2)])
+    historico = Historico(ordinais, np.arange(16.0).reshape(4, 4), np.arange(4.0)).anual()
+    assert [rotulo_br(o) for o in historico.ordinais.tolist()] == ["12/2020", "02/2021"]
+    assert historico.punitivo.tolist() == [1.0, 3.0]
+    assert historico.valores[:, 0].tolist() == [4.0, 12.0]
+
+def test_cache_e_etag(cliente, monkeypatch):
+    primeira = cliente.post("/calcular", json=ATIVO)
+    etag = primeira.headers["ETag"]
+
+    # Segunda vez sai do disco, sem gerar o PDF de novo
+    gerar = modulo_app.gerar_pdf_para_ativo
+    def nao_gerar(*args, **kwargs):
+        raise AssertionError("PDF deveria vir do cache")
+    monkeypatch.setattr(modulo_app, "gerar_pdf_para_ativo", nao_gerar)
+    segunda = cliente.post("/calcular", json=ATIVO)
+    assert segunda.data == primeira.data
+    assert segunda.headers["ETag"] == etag
+
+    condicional = cliente.post("/calcular", json=ATIVO, headers={"If-None-Match": etag})
+    assert condicional.status_code == 304
+    assert condicional.data == b""
+
+    # Outro valor (ou outro relatório) é outra chave
+    outro = {**ATIVO, "Juros": (ATIVO.get("Juros") or 0.0) + 0.001}
+    monkeypatch.setattr(modulo_app, "gerar_pdf_para_ativo", gerar)
+    assert cliente.post("/calcular", json=outro).headers["ETag"] != etag
+
+def test_poda_remove_os_menos_usados(tmp_path):
+    cache = CacheArquivos(str(tmp_path), max_bytes=10_000, extensao=".pdf")
+    for i in range(5):
+        os.utime(cache.gravar(f"{i:02d}abc", b"x" * 300), (i, i))
+    cache.obter("00abc")  # acerto renova o arquivo mais antigo
+    cache.max_bytes = 1000
+    cache.podar()
+    assert [c for c in (f"{i:02d}abc" for i in range(5)) if os.path.exists(cache.caminho(c))] == ["00abc", "03abc", "04abc"]
+
+def test_lote_zip_em_fluxo(cliente):
+    ativos = [ATIVO, {**ATIVO, "Principal Líquido": 1.0}, {"Nome Completo": "sem OC"}]
+    resposta = cliente.post("/calcular/lote?relatorio=resumo", json=ativos, buffered=False)
+    assert resposta.is_streamed
+    assert resposta.headers.get("Content-Length") is None
+    conteudo = b"".join(resposta.response)
+    with zipfile.ZipFile(io.BytesIO(conteudo)) as zf:
+        assert zf.testzip() is None
+        nomes = zf.namelist()
+        assert len(nomes) == 3 and nomes[-1] == "erros.json"
+        assert nomes[0] != nomes[1]  # mesmo nome de ativo => sufixo
+        assert json.loads(zf.read("erros.json"))[0]["linha"] == 3
+
+def test_janela_limita_tarefas_em_andamento():
+    class PoolFalso:
+        def __init__(self):
+            self.enviadas = self.consumidas = self.max_pendentes = 0
+
+        def apply_async(self, funcao, args):
+            self.enviadas += 1
+            self.max_pendentes = max(self.max_pendentes, self.enviadas - self.consumidas)
+            pool = self
+
+            class Resultado:
+                def get(self_):
+                    pool.consumidas += 1
+                    return args[0]
+            return Resultado()
+
+    pool = PoolFalso()
+    assert list(paralelo._em_janela(pool, iter(range(20)), 3)) == list(range(20))
+    assert pool.max_pendentes == 3
+
+def test_valores_nao_numericos(cliente):
+    resposta = cliente.post("/calcular?format=json", json={**ATIVO, "Juros": "abc"})
+    assert resposta.status_code == 400
+    assert resposta.get_json()["error"] == "Valores do ativo devem ser numéricos"
+    texto = cliente.post("/calcular?format=json", json={**ATIVO, "Juros": str(ATIVO.get("Juros") or 0)})
+    assert texto.get_json()["Valor Total do Ativo"] == cliente.post("/calcular?format=json", json=ATIVO).get_json()["Valor Total do Ativo"]
+
+def test_nome_pdf_sem_diretorios():
+    for nome in ("../../etc/passwd", "a\\..\\b", "x/../y"):
+        final = modulo_app.nome_pdf(nome)
+        assert "/" not in final and "\\" not in final and ".." not in final
+
+def test_lote_zip_erro_no_pdf_fica_na_linha(cliente, monkeypatch):
+    # Nome com marcação sai escapado no título; erro de renderização vira erro da linha
+    marcacao = {**ATIVO, "Nome Completo": "Silva & <b>Cia"}
+    assert cliente.post("/calcular?relatorio=resumo", json=marcacao).status_code == 200
+
+    gerar = modulo_app.gerar_pdf_para_ativo
+    def gerar_ou_falhar(nome_ativo, *args, **kwargs):
+        if nome_ativo == "quebra":
+            raise ValueError("falha no ReportLab")
+        return gerar(nome_ativo, *args, **kwargs)
+    monkeypatch.setattr(modulo_app, "gerar_pdf_para_ativo", gerar_ou_falhar)
+
+    ativos = [marcacao, {**ATIVO, "Nome Completo": "quebra"}, ATIVO]
+    resposta = cliente.post("/calcular/lote?relatorio=resumo", json=ativos, buffered=False)
+    with zipfile.ZipFile(io.BytesIO(b"".join(resposta.response))) as zf:
+        assert zf.testzip() is None
+        assert len(zf.namelist()) == 3 and zf.namelist()[-1] == "erros.json"
+        assert json.loads(zf.read("erros.json")) == [
+            {"linha": 2, "Nome Completo": "quebra", "erro": "Erro no PDF: falha no ReportLab"}
+        ]
@@ -0,0 +1,86 @@
+"""
+Planilhas em fluxo (fluxo_lote.py): CSV e XLSX lidos em blocos têm de dar os
+mesmos totais do cálculo avulso, e o histórico no XLSX continua em outra aba
+ao chegar ao limite de linhas.
+"""
+import io
+
+import pandas as pd
+import pytest
+from openpyxl import load_workbook
+
+from app import calcular_ativo
+from fluxo_lote import COLUNAS_HISTORICO, EscritorCSV, EscritorXLSX, processar_planilha
+from lote import COLUNAS_TOTAIS
+from tabelas import registro_tabelas
+from tests.test_golden import CASOS
+
+FINAL_DATE = pd.Timestamp("2025-02-01")
+ATIVOS = [c["ativo"] for c in CASOS] + [{"Nome Completo": "Sem Data Base", "Ordem Cronológica": "0001/2024"}]
+
+def _entrada(formato):
+    df = pd.DataFrame(ATIVOS)
+    buf = io.BytesIO()
+    if formato == "csv":
+        df.to_csv(buf, sep=";", index=False, encoding="utf-8-sig")
+    else:
+        df.to_excel(buf, index=False)
+    buf.seek(0)
+    return buf
+
+def _esperado():
+    totais = []
+    for ativo in ATIVOS:
+        resultado, erro = calcular_ativo(ativo, FINAL_DATE, historico=False)
+        totais.append(None if erro else round(resultado["valor_total_final"], 2))
+    return totais
+
+@pytest.mark.parametrize("formato", ["csv", "xlsx"])
+def test_csv_em_blocos(formato):
+    totais_csv, historico_csv = io.BytesIO(), io.BytesIO()
+    total, erros = processar_planilha(
+        _entrada(formato), f"ativos.{formato}", EscritorCSV(totais_csv, historico_csv),
+        FINAL_DATE, registro_tabelas.atual(), tamanho=5,
+    )
+    assert (total, erros) == (len(ATIVOS), 1)
+
+    totais = pd.read_csv(io.BytesIO(totais_csv.getvalue()), encoding="utf-8-sig")
+    assert list(totais.columns) == COLUNAS_TOTAIS
+    assert totais["linha"].tolist() == list(range(1, len(ATIVOS) + 1))
+    esperado = _esperado()
+    assert totais["Valor Total do Ativo"].tolist()[:-1] == esperado[:-1]
+    assert totais["erro"].tolist()[-1] == "Data Base ausente ou inválida"
+
+    historico = pd.read_csv(io.BytesIO(historico_csv.getvalue()), encoding="utf-8-sig")
+    assert list(historico.columns) == COLUNAS_HISTORICO
+    # Último mês de cada ativo = total da linha
+    ultimos = historico.groupby("linha")["Valor Total do Ativo"].last()
+    assert ultimos.tolist() == esperado[:-1]
+
+def test_xlsx_historico_em_varias_abas():
+    saida = io.BytesIO()
+    escritor = EscritorXLSX(saida, historico=True, linhas_por_aba=1000)
+    processar_planilha(_entrada("xlsx"), "ativos.xlsx", escritor, FINAL_DATE, registro_tabelas.atual(), tamanho=5)
+
+    historico_csv = io.BytesIO()
+    processar_planilha(
+        _entrada("csv"), "ativos.csv", EscritorCSV(io.BytesIO(), historico_csv),
+        FINAL_DATE, registro_tabelas.atual(), tamanho=5,
+    )
+    esperado = pd.read_csv(io.BytesIO(historico_csv.getvalue()), encoding="utf-8-sig")
+
+    wb = load_workbook(io.BytesIO(saida.getvalue()), read_only=True)
+    abas = wb.sheetnames
+    assert abas[0] == "Totais"
+    assert abas[1:] == ["Histórico"] + [f"Histórico {n}" for n in range(2, len(abas))]
+    assert len(abas) > 2
+    linhas = []
+    for nome in abas[1:]:
+        aba = list(wb[nome].iter_rows(values_only=True))
+        assert list(aba[0]) == COLUNAS_HISTORICO
+        assert len(aba) <= 1000
+        linhas.extend(aba[1:])
+    wb.close()
+    assert len(linhas) == len(esperado)
+    assert [r[0] for r in linhas] == esperado["linha"].tolist()
+    assert [r[-1] for r in linhas] == esperado["Valor Total do Ativo"].tolist()
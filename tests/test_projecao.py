@@ -0,0 +1,99 @@
+"""
+Projeções com cenários: sem curva têm de bater com calcular_ativo, e uma curva
+igual aos meses reais tem de reproduzir as tabelas completas.
+"""
+import copy
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import app, calcular_ativo, entrada_ativo
+from projecao import ler_cenarios, projetar
+from tabelas import IndiceMensal, ordinal_data, ordinal_mes, registro_tabelas
+from tests.test_golden import CASOS, centavos_iguais
+
+ALVOS = ["2010-06-01", "2024-12-01", "2025-02-01", "2026-07-01", "2028-12-01"]
+
+def _projetar(ativo, alvos, cenarios, tabelas):
+    (_, oc, data_base, valores, _), erro = entrada_ativo(ativo)
+    assert erro is None, erro
+    return projetar(oc, ordinal_data(data_base), valores, [ordinal_data(pd.Timestamp(a)) for a in alvos], cenarios, tabelas)
+
+def _truncadas(tabelas, ord_fim):
+    """Cópia das tabelas com SELIC e IPCA-E só até ord_fim."""
+    def cortar(indice):
+        valores = indice.valores.copy()
+        valores[np.arange(indice.inicio, indice.fim + 1) > ord_fim] = np.nan
+        return IndiceMensal(indice.inicio, valores)
+    truncadas = copy.copy(tabelas)
+    truncadas.selic, truncadas.ipcae, truncadas.versao = cortar(tabelas.selic), cortar(tabelas.ipcae), "truncadas"
+    return truncadas
+
+@pytest.mark.parametrize("caso", CASOS, ids=[c["nome"] for c in CASOS])
+def test_sem_curva_igual_ao_calculo(caso):
+    cenarios, _ = ler_cenarios(None)
+    normal, punitivo = _projetar(caso["ativo"], ALVOS, cenarios, registro_tabelas.atual())
+    for j, alvo in enumerate(ALVOS):
+        resultado, _ = calcular_ativo(caso["ativo"], pd.Timestamp(alvo), historico=False)
+        assert centavos_iguais(
+            [normal[0, j], punitivo[0, j]], [resultado["valor_normal_final"], resultado["valor_punitivo_final"]]
+        ), alvo
+
+@pytest.mark.parametrize("caso", CASOS, ids=[c["nome"] for c in CASOS])
+def test_curva_real_reproduz_tabelas(caso):
+    tabelas = registro_tabelas.atual()
+    fim = ordinal_mes(2023, 12)
+    meses = range(fim + 1, ordinal_mes(2025, 2) + 1)
+    curva_selic = {f"{o // 12}-{o % 12 + 1:02d}": float(tabelas.selic.valor(o)) for o in meses}
+    curva_ipcae = {f"{o // 12}-{o % 12 + 1:02d}": (tabelas.ipcae.razao(o, o - 1) - 1) * 100 for o in meses}
+    cenarios, erro = ler_cenarios([
+        {"nome": "real", "selic": curva_selic, "ipcae": curva_ipcae},
+        {"nome": "alto", "selic": 2.0, "ipcae": 1.0},
+    ])
+    assert erro is None, erro
+
+    alvos = ["2024-01-01", "2024-06-01", "2025-02-01"]
+    normal, punitivo = _projetar(caso["ativo"], alvos, cenarios, _truncadas(tabelas, fim))
+    for j, alvo in enumerate(alvos):
+        resultado, _ = calcular_ativo(caso["ativo"], pd.Timestamp(alvo), historico=False)
+        assert centavos_iguais(
+            [normal[0, j], punitivo[0, j]], [resultado["valor_normal_final"], resultado["valor_punitivo_final"]]
+        ), alvo
+
+def test_rota_projecao():
+    ativo = CASOS[0]["ativo"]
+    cliente = app.test_client()
+    resposta = cliente.post("/projecao", json={
+        "ativos": [ativo, {"Nome Completo": "sem OC"}],
+        "datas": ["2027-12-01"],
+        "cenarios": [{"nome": "baixo", "selic": 0.5}, {"nome": "alto", "selic": {"padrao": 1.0, "2026-01": 1.5}}],
+    })
+    assert resposta.status_code == 200
+    corpo = resposta.get_json()
+    assert corpo["cenarios"] == ["baixo", "alto"]
+    projecoes = corpo["ativos"][0]["projecoes"]
+    assert [p["cenario"] for p in projecoes] == ["baixo", "alto"]
+    assert projecoes[0]["Valor Total do Ativo"] < projecoes[1]["Valor Total do Ativo"]
+    assert "erro" in corpo["ativos"][1]
+
+    # OC numérica e valor não numérico: normalizado / erro só daquele ativo
+    resposta = cliente.post("/projecao", json={"ativos": [
+        {**ativo, "Ordem Cronológica": 2021}, {**ativo, "Juros": "abc"},
+    ]})
+    assert resposta.status_code == 200
+    corpo = resposta.get_json()
+    assert "projecoes" in corpo["ativos"][0]
+    assert corpo["ativos"][1]["erro"] == "Valores do ativo devem ser numéricos"
+
+    # Data antes da Data Base: erro daquele ativo (a projeção daria 0,00)
+    resposta = cliente.post("/projecao", json={
+        "ativos": [ativo, {**ativo, "Data Base": "2028-01-01"}], "datas": ["2027-12-01"],
+    })
+    assert resposta.status_code == 200
+    corpo = resposta.get_json()
+    assert "projecoes" in corpo["ativos"][0]
+    assert corpo["ativos"][1]["erro"] == "Data anterior à Data Base (2028-01)"
+
+    resposta = cliente.post("/projecao", json={"ativo": ativo, "cenarios": [{"selic": "alta"}]})
+    assert resposta.status_code == 400
@@ -0,0 +1,29 @@
+"""
+Ponto de entrada de produção.
+
+    gunicorn -c gunicorn.conf.py wsgi:app     (Linux; vários processos, preload)
+    python wsgi.py                            (waitress; um processo com threads)
+
+As tabelas são carregadas ao importar este módulo; com o preload do gunicorn
+isso acontece uma vez, no mestre, antes do fork dos workers.
+"""
+import os
+
+from app import criar_app, iniciar_processo, encerrar_processo
+
+app = criar_app()
+
+if __name__ == "__main__":
+    from waitress import serve
+
+    iniciar_processo()
+    try:
+        serve(
+            app,
+            host="0.0.0.0",
+            port=int(os.environ.get("PORT", 5000)),
+            threads=int(os.environ.get("LMCALC_WEB_THREADS", 8)),
+            channel_timeout=int(os.environ.get("LMCALC_WEB_TIMEOUT", 120)),
+        )
+    finally:
+        encerrar_processo()